@@ -0,0 +1,88 @@
+"""
+Import-time profile of the bot startup (like `python -X importtime`).
+
+It imports `main` and all the cogs in a fresh interpreter, prints the slowest imports and fails if a heavy module
+(which must be imported lazily, on first use) is imported at startup or if the total import time exceeds the limit.
+
+Usage: python -m benchmarks.import_time [--top 20] [--max-ms 3000]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported when the bot starts
+LAZY_MODULES = {'paddle', 'paddleocr', 'paddlex', 'pandas', 'matplotlib'}
+
+
+def get_startup_modules() -> list[str]:
+    """
+    Get the modules imported when the bot starts (main and the cogs loaded in setup_hook).
+
+    :return: The names of the modules
+    """
+
+    cogs = sorted(file[:-3] for file in os.listdir(os.path.join(ROOT, 'src', 'cogs')) if file.endswith('.py'))
+    return ['main'] + [f'src.cogs.{cog}' for cog in cogs]
+
+
+def profile_imports(modules: list[str]) -> list[tuple[str, int, int]]:
+    """
+    Import the modules in a new interpreter with `-X importtime`.
+
+    :param modules: The modules to import
+    :return: A list of (module, self time, cumulative time), times in microseconds
+    """
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {', '.join(modules)}"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to import the bot modules:\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        self_time, cumulative_time, module = line.removeprefix('import time:').split('|')
+        imports.append((module.strip(), int(self_time), int(cumulative_time)))
+
+    return imports
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import-time profile of the bot startup")
+    parser.add_argument('--top', type=int, default=20, help="Number of slowest imports to show")
+    parser.add_argument('--max-ms', type=float, default=None, help="Fail if the total import time exceeds this value")
+    args = parser.parse_args()
+
+    imports = profile_imports(get_startup_modules())
+    total_ms = sum(self_time for _, self_time, _ in imports) / 1000
+
+    print(f"{'cumulative [ms]':>16} {'self [ms]':>10}  module")
+    for module, self_time, cumulative_time in sorted(imports, key=lambda i: i[2], reverse=True)[:args.top]:
+        print(f"{cumulative_time / 1000:16.1f} {self_time / 1000:10.1f}  {module}")
+
+    print(f"\nTotal import time: {total_ms:.1f} ms ({len(imports)} modules)")
+
+    failed = False
+
+    eager = sorted({module for module, _, _ in imports if module.split('.')[0] in LAZY_MODULES})
+    if eager:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(eager)}")
+        failed = True
+
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f"FAIL: total import time {total_ms:.1f} ms exceeds {args.max_ms} ms")
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
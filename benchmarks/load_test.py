@@ -0,0 +1,296 @@
+"""
+End-to-end load test of the variations check, without the real school site, Discord or production Mongo.
+
+It starts a local aiohttp server that serves a fake variations page with the PDFs of a directory (one more PDF is
+published at each tick, or all of them with --static), replaces Discord with an in-memory stand-in that records the
+API calls and simulates the per-channel rate limits, and runs N checks against a local Mongo (or mongomock-motor).
+It reports the end-to-end latency of each tick (check + delivery of all the messages) and the API calls made.
+
+The PDF file names must contain the date of the variations, as in the school site (e.g. "Variazioni 20 ottobre.pdf").
+
+Usage:
+    python -m benchmarks.load_test PDF_DIR [--ticks 5] [--static] [--mongomock | --mongo-url mongodb://localhost:27017]
+                                   [--reset] [--school-year 99] [--discord-latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter, deque
+from datetime import datetime
+from urllib.parse import urlparse
+
+import pytz
+from aiohttp import web
+
+from src.api.iti._iti_ import ITIAPI
+from src.api.iti.variations import VariationsAPI
+from src.commands.analytics.engine import AnalyticsEngine
+from src.loops.check_variations.check_variations import run_variations_check
+from src.loops.check_variations.send_embeds import send_outbox, send_outbox_lock
+from src.mongo_db.variations_db import VariationsDB
+from src.mongo_db.variations_window import VariationsWindow
+from src.utils.metrics import metrics, PrometheusRegistry, Metrics
+
+
+class FakeDiscord:
+    """
+    Records the Discord API calls and simulates the rate limits (a sliding window for each route bucket).
+    """
+
+    def __init__(self, bucket_size: int = 5, bucket_period: float = 5.0, latency: float = 0.05):
+        self.bucket_size = bucket_size
+        self.bucket_period = bucket_period
+        self.latency = latency
+
+        self.calls = Counter()
+        self.rate_limited = 0
+        self.last_call_at = 0.0
+        self.__buckets: dict[str, deque[float]] = {}
+        self.__next_id = 0
+
+    async def request(self, route: str, bucket: str) -> None:
+        window = self.__buckets.setdefault(bucket, deque())
+
+        while True:
+            now = time.monotonic()
+            while window and now - window[0] >= self.bucket_period:
+                window.popleft()
+
+            if len(window) < self.bucket_size:
+                break
+
+            # 429: wait for the bucket to reset, as discord.py does
+            self.rate_limited += 1
+            await asyncio.sleep(window[0] + self.bucket_period - now)
+
+        window.append(now)
+        self.calls[route] += 1
+
+        await asyncio.sleep(self.latency)
+        self.last_call_at = time.monotonic()
+
+    def new_id(self) -> int:
+        self.__next_id += 1
+        return self.__next_id
+
+
+class FakeMessage:
+    def __init__(self, discord: FakeDiscord, channel: 'FakeChannel'):
+        self.id = discord.new_id()
+        self.discord = discord
+        self.channel = channel
+
+    async def add_reaction(self, _):
+        await self.discord.request('add_reaction', f'reactions-{self.channel.id}')
+
+
+class FakeChannel:
+    def __init__(self, discord: FakeDiscord, name: str):
+        self.id = discord.new_id()
+        self.discord = discord
+        self.name = name
+
+    async def send(self, content: str = None, embed=None, embeds=None) -> FakeMessage:
+        await self.discord.request('send_message', f'messages-{self.id}')
+        return FakeMessage(self.discord, self)
+
+
+class FakeRole:
+    def __init__(self, name: str):
+        self.name = name
+        self.mention = f"<@&{name}>"
+
+
+class FakeDirectory:
+    """ Every class has its role and its channel. """
+
+    def __init__(self, discord: FakeDiscord):
+        self.discord = discord
+        self.channels: dict[str, FakeChannel] = {}
+
+    async def get_or_fetch_role(self, name: str) -> FakeRole:
+        return FakeRole(name)
+
+    async def get_or_fetch_channel(self, name: str) -> FakeChannel:
+        if name not in self.channels:
+            self.channels[name] = FakeChannel(self.discord, name)
+
+        return self.channels[name]
+
+
+class FakeUser:
+    mention = "<@owner>"
+
+
+class FakeBot:
+    """ The attributes of the bot used by the variations check. """
+
+    def __init__(self, mongo_client, school_year: int, discord: FakeDiscord):
+        self.mongo_client = mongo_client
+        self.school_year = school_year
+        self.directory = FakeDirectory(discord)
+        self.analytics = AnalyticsEngine(mongo_client, school_year)
+        self.variations_window = VariationsWindow(VariationsDB(mongo_client, school_year))
+        self.owner = FakeUser()
+        self.log_channel = FakeChannel(discord, 'log')
+        self.admin_channel = FakeChannel(discord, 'admin')
+
+    def schedule_plots_generation(self) -> None:
+        pass
+
+
+class FakeSite:
+    """
+    Local variations page: it lists the published PDFs of the directory, served under /pdf/.
+    """
+
+    def __init__(self, pdf_dir: str):
+        self.pdfs = {file: open(os.path.join(pdf_dir, file), 'rb').read()
+                     for file in sorted(os.listdir(pdf_dir)) if file.lower().endswith('.pdf')}
+        self.published: list[str] = []
+        self.requests = Counter()
+        self.url = None
+        self.__runner = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/pdf/{name}', self.__handle_pdf)
+        app.router.add_get('/{tail:.*}', self.__handle_page)
+
+        self.__runner = web.AppRunner(app)
+        await self.__runner.setup()
+
+        site = web.TCPSite(self.__runner, '127.0.0.1', 0)
+        await site.start()
+
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self) -> None:
+        await self.__runner.cleanup()
+
+    def publish(self, count: int) -> None:
+        self.published = list(self.pdfs)[:count]
+
+    async def __handle_page(self, _):
+        self.requests['page'] += 1
+
+        links = "".join(f'<p><a href="{self.url}/pdf/{name}">{name}</a></p>' for name in self.published)
+        return web.Response(text=f'<html><body><div id="maincontent">{links}</div></body></html>',
+                            content_type='text/html')
+
+    async def __handle_pdf(self, request):
+        self.requests['pdf'] += 1
+
+        name = request.match_info['name']
+        if name not in self.pdfs:
+            raise web.HTTPNotFound()
+
+        return web.Response(body=self.pdfs[name], content_type='application/pdf')
+
+
+def get_mongo_client(args):
+    if args.mongomock:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("mongomock-motor is not installed (pip install mongomock-motor)")
+
+        return AsyncMongoMockClient()
+
+    # The test writes in the ITI database, so only a local instance is allowed
+    if urlparse(args.mongo_url).hostname not in ('localhost', '127.0.0.1'):
+        sys.exit("Only a local Mongo instance can be used for load tests")
+
+    import motor.motor_asyncio as motor
+    return motor.AsyncIOMotorClient(args.mongo_url)
+
+
+async def wait_delivery(bot) -> None:
+    """ Wait until the outbox has been completely sent. """
+
+    await asyncio.sleep(0)
+
+    while send_outbox_lock.locked():
+        await asyncio.sleep(0.01)
+
+    await send_outbox(bot)
+
+
+async def run(args) -> int:
+    site = FakeSite(args.pdf_dir)
+    if not site.pdfs:
+        print(f"No PDFs found in {args.pdf_dir}")
+        return 1
+
+    await site.start()
+
+    ITIAPI.BASE_URL = site.url
+    VariationsAPI.PDF_LINKS_PREFIX = f"{site.url}/pdf/"
+
+    registry = PrometheusRegistry()
+    metrics.add_sink(registry)
+
+    mongo_client = get_mongo_client(args)
+    if args.reset:
+        await mongo_client.drop_database('ITI')
+
+    discord = FakeDiscord(latency=args.discord_latency)
+    bot = FakeBot(mongo_client, args.school_year, discord)
+
+    print(f"{'tick':>4} {'published':>9} {'changed':>7} {'latency [s]':>11} {'sends':>5} {'429':>4}")
+
+    latencies = []
+    try:
+        for tick in range(args.ticks):
+            site.publish(len(site.pdfs) if args.static else tick + 1)
+
+            sends_before = discord.calls['send_message']
+            rate_limited_before = discord.rate_limited
+
+            start = time.monotonic()
+            changed = await run_variations_check(bot, datetime.now(pytz.timezone('Europe/Rome')))
+            await wait_delivery(bot)
+            latency = time.monotonic() - start
+            latencies.append(latency)
+
+            print(f"{tick + 1:4} {len(site.published):9} {str(changed):>7} {latency:11.3f} "
+                  f"{discord.calls['send_message'] - sends_before:5} {discord.rate_limited - rate_limited_before:4}")
+
+        # Let the background reactions finish
+        while time.monotonic() - discord.last_call_at < 1:
+            await asyncio.sleep(0.1)
+    finally:
+        await site.stop()
+
+    print(f"\nLatency: avg {sum(latencies) / len(latencies):.3f}s, max {max(latencies):.3f}s")
+    print(f"Discord API calls: {dict(discord.calls)}, rate limited: {discord.rate_limited}")
+    print(f"School site requests: {dict(site.requests)}")
+
+    print("\nStages:")
+    for (name, labels), (count, total, maximum) in sorted(registry.summaries.items()):
+        if name == Metrics.STAGE_DURATION:
+            print(f"  {dict(labels)}: count {count}, avg {total / count:.3f}s, max {maximum:.3f}s")
+
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="End-to-end load test of the variations check")
+    parser.add_argument('pdf_dir', help="Directory containing the PDFs to serve")
+    parser.add_argument('--ticks', type=int, default=5, help="Number of checks to run")
+    parser.add_argument('--static', action='store_true', help="Publish all the PDFs from the first tick")
+    parser.add_argument('--mongomock', action='store_true', help="Use mongomock-motor instead of a local Mongo")
+    parser.add_argument('--mongo-url', default='mongodb://localhost:27017', help="Local Mongo instance")
+    parser.add_argument('--reset', action='store_true', help="Drop the ITI database before starting")
+    parser.add_argument('--school-year', type=int, default=99, help="School year (collection) to use")
+    parser.add_argument('--discord-latency', type=float, default=0.05, help="Latency of each Discord API call")
+    args = parser.parse_args()
+
+    return asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
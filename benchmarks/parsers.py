@@ -0,0 +1,197 @@
+"""
+Offline benchmark of the variations parsers over a directory of stored PDFs (no Discord or Mongo needed).
+
+Each parser (and the full VariationsAPI cascade) runs on each PDF in a fresh process, reporting wall time, CPU time,
+peak RSS, rotations tried and variations extracted. Results can be saved as a baseline and compared with it.
+
+Usage:
+    python -m benchmarks.parsers PDF_DIR [--parsers excel new old ocr cascade]
+                                 [--save-baseline FILE] [--baseline FILE] [--threshold 0.2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+PARSERS = ['excel', 'new', 'old', 'ocr', 'cascade']
+
+# Metrics compared with the baseline (a regression is a value higher than baseline * (1 + threshold))
+COMPARED_METRICS = ['wall', 'cpu', 'peak_rss_mb']
+
+
+def get_parser(name: str):
+    """
+    Get the parser to benchmark (imported here, so that each process imports only what it needs).
+
+    :param name: The name of the parser (one of PARSERS)
+    :return: An async callable taking the PDF (as PDFBuffer) and returning the variations
+    """
+
+    match name:
+        case 'excel':
+            from src.api.iti.variations_parsers.excel_ui import ExcelUIParser
+            return ExcelUIParser()
+        case 'new':
+            from src.api.iti.variations_parsers.new_ui import NewUIParser
+            return NewUIParser()
+        case 'old':
+            from src.api.iti.variations_parsers.old_ui import OldUIParser
+            return OldUIParser()
+        case 'ocr':
+            from src.api.iti.variations_parsers.ocr import OCRParser
+            return OCRParser()
+        case 'cascade':
+            from src.api.iti.variations import VariationsAPI
+
+            from src.utils.pdf_utils import PDFBuffer
+
+            async def cascade(pdf: PDFBuffer):
+                variations, _ = await VariationsAPI._VariationsAPI__parse_pdf(pdf)
+                return variations
+
+            return cascade
+
+    raise ValueError(f"Unknown parser: {name}")
+
+
+def run_parser(parser_name: str, pdf_path: str) -> dict:
+    """
+    Run a parser on a PDF (executed in a new process, so peak RSS is measured for this run only).
+
+    :param parser_name: The name of the parser
+    :param pdf_path: The path of the PDF
+    :return: The results of the run
+    """
+
+    from src.utils.metrics import metrics, MetricsSink
+
+    class AttemptsCounter(MetricsSink):
+        def __init__(self):
+            self.attempts = 0
+
+        def inc(self, name, value, labels, fields):
+            pass
+
+        def observe(self, name, value, labels, fields):
+            if labels.get('stage') in ('parse', 'ocr'):
+                self.attempts += 1
+
+    counter = AttemptsCounter()
+    metrics.add_sink(counter)
+
+    from src.utils.pdf_utils import PDFBuffer
+
+    with open(pdf_path, 'rb') as f:
+        pdf = PDFBuffer(f.read())
+
+    parser = get_parser(parser_name)
+
+    error = None
+    variations = None
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    try:
+        variations = asyncio.run(parser(pdf))
+    except Exception as e:
+        error = f"{e.__class__.__name__}: {e}"
+    finally:
+        pdf.close()
+
+    return {
+        'wall': time.perf_counter() - wall_start,
+        'cpu': time.process_time() - cpu_start,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,     # KB on Linux
+        'rotations': counter.attempts,
+        'rows': len(variations) if variations else 0,
+        'error': error
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Compare the results with the baseline.
+
+    :param results: The results ({file: {parser: result}})
+    :param baseline: The baseline (same structure)
+    :param threshold: The relative increase tolerated (e.g. 0.2 = 20%)
+    :return: The regressions found
+    """
+
+    regressions = []
+
+    for file, parsers in results.items():
+        for parser, result in parsers.items():
+            base = baseline.get(file, {}).get(parser)
+            if base is None:
+                continue
+
+            for metric in COMPARED_METRICS:
+                if base[metric] > 0 and result[metric] > base[metric] * (1 + threshold):
+                    regressions.append(f"{file} [{parser}] {metric}: {base[metric]:.3f} -> {result[metric]:.3f}")
+
+            if result['rows'] != base['rows']:
+                regressions.append(f"{file} [{parser}] rows: {base['rows']} -> {result['rows']}")
+
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmark of the variations parsers")
+    parser.add_argument('pdf_dir', help="Directory containing the PDFs")
+    parser.add_argument('--parsers', nargs='+', choices=PARSERS, default=PARSERS, help="Parsers to benchmark")
+    parser.add_argument('--save-baseline', metavar='FILE', help="Save the results as baseline")
+    parser.add_argument('--baseline', metavar='FILE', help="Compare the results with this baseline")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Relative increase considered a regression")
+    args = parser.parse_args()
+
+    pdfs = sorted(file for file in os.listdir(args.pdf_dir) if file.lower().endswith('.pdf'))
+    if not pdfs:
+        print(f"No PDFs found in {args.pdf_dir}")
+        return 1
+
+    results = {}
+
+    print(f"{'file':40} {'parser':8} {'wall [s]':>9} {'cpu [s]':>8} {'rss [MB]':>9} {'rot.':>5} {'rows':>5}")
+
+    # A new process for each run, so that peak RSS and imports don't leak between runs
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+        for pdf in pdfs:
+            results[pdf] = {}
+
+            for parser_name in args.parsers:
+                result = executor.submit(run_parser, parser_name, os.path.join(args.pdf_dir, pdf)).result()
+                results[pdf][parser_name] = result
+
+                print(f"{pdf[:40]:40} {parser_name:8} {result['wall']:9.3f} {result['cpu']:8.3f} "
+                      f"{result['peak_rss_mb']:9.1f} {result['rotations']:5} {result['rows']:5}"
+                      f"{'  ' + result['error'] if result['error'] else ''}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions (threshold {args.threshold:.0%}):")
+            print("\n".join(regressions))
+            return 1
+
+        print("\nNo regressions")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
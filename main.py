@@ -4,15 +4,22 @@ import os
 import sys
 
 import motor.motor_asyncio as motor
-from discord import Intents, Object, LoginFailure, Activity, ActivityType, Guild
+from discord import Intents, Object, LoginFailure, Activity, ActivityType, Guild, Member, User
 from discord.ext.commands import Bot
 from dotenv import load_dotenv
 
+from src.api.iti._iti_ import ITIAPI
+from src.api.iti.circuit_breaker import CircuitBreaker
 from src.commands.analytics.analytics import AnalyticsView
-from src.commands.analytics.plots import generate_plots
+from src.commands.analytics.engine import AnalyticsEngine
+from src.loops.check_variations.send_embeds import recover_staged_entries
 from src.loops.new_year.ui.select_class_view import SelectClassView
 from src.mongo_db.config_db import ConfigDB
 from src.mongo_db.variations_db import VariationsDB
+from src.mongo_db.variations_window import VariationsWindow
+from src.utils.discord_utils import GuildDirectory, notify_owner
+from src.utils.metrics import metrics, PrometheusRegistry, JSONLogSink, start_metrics_server
+from src.utils.utils import create_background_task
 
 load_dotenv()
 
@@ -27,6 +34,7 @@ class ITIBot(Bot):
         self.guild_id = Object(id=int(os.environ['GUILD_ID'] if prod else os.environ['GUILD_ID_TEST']))
 
         self.guild = None
+        self.directory = None
         self.me = None
         self.owner = int(os.environ['OWNER_ID'])
 
@@ -42,21 +50,48 @@ class ITIBot(Bot):
         self.analytics_view = None
         self.select_class_view = None
 
+        self.__ready_once = False
+        self.__plots_task = None
+        self.__plots_outdated = False
+
     async def setup_hook(self):
         print("-- Setting up bot --")
 
-        self.guild: Guild = await self.fetch_guild(self.guild_id.id)
-        self.owner = self.get_user(self.owner) or await self.fetch_user(self.owner)
-        self.me = await self.guild.fetch_member(self.user.id)
-
-        # Fetch channels
-        self.announce_channel = await self.fetch_channel(self.announce_channel)
-        self.log_channel = await self.fetch_channel(self.log_channel)
-        self.select_channel = await self.fetch_channel(self.select_channel)
-        self.analytics_channel = await self.fetch_channel(self.analytics_channel)
-        self.admin_channel = await self.fetch_channel(self.admin_channel)
-
-        print("-- Channels fetched --")
+        await self.__setup_metrics()
+
+        # Discord fetches and Mongo setup are independent, so they run concurrently
+        (
+            (self.guild, self.me),
+            self.owner,
+            self.announce_channel,
+            self.log_channel,
+            self.select_channel,
+            self.analytics_channel,
+            self.admin_channel,
+            (self.school_year, classes)
+        ) = await asyncio.gather(
+            self.__fetch_guild_and_me(),
+            self.__get_or_fetch_user(self.owner),
+            self.fetch_channel(self.announce_channel),
+            self.fetch_channel(self.log_channel),
+            self.fetch_channel(self.select_channel),
+            self.fetch_channel(self.analytics_channel),
+            self.fetch_channel(self.admin_channel),
+            self.__setup_mongo()
+        )
+
+        self.directory = GuildDirectory(self.guild)
+        self.analytics = AnalyticsEngine(self.mongo_client, self.school_year)
+
+        ITIAPI.circuit_breaker.add_listener(self.__notify_circuit_breaker)
+
+        self.variations_window = VariationsWindow(VariationsDB(self.mongo_client, self.school_year))
+        await self.variations_window.load()
+
+        # Before the loops start, since the entries of a running check are staged too
+        await recover_staged_entries(self)
+
+        print("-- Guild, channels and config fetched --")
 
         # Load cogs
         for file in os.listdir("src//cogs"):
@@ -65,48 +100,113 @@ class ITIBot(Bot):
 
         print("-- Cogs loaded --")
 
-        self.mongo_client = motor.AsyncIOMotorClient(os.environ['MONGO_URL'])
-
         # Load persistent roles and analytics
-        config_db = ConfigDB(self.mongo_client)
-
-        self.school_year = await config_db.get_current_school_year()
-
-        self.analytics_view = AnalyticsView(self.mongo_client, self.school_year)
-        self.select_class_view = SelectClassView(await config_db.get_classes())
+        self.analytics_view = AnalyticsView(self.mongo_client, self.analytics)
+        self.select_class_view = SelectClassView(classes)
 
         self.add_view(self.select_class_view)
         self.add_view(self.analytics_view)
 
         print("-- Setup complete --")
 
+    async def __setup_metrics(self):
+        """ Registers the metrics sinks: Prometheus registry (served locally if METRICS_PORT is set) and JSON logs. """
+
+        registry = PrometheusRegistry()
+        metrics.add_sink(registry)
+
+        if os.environ.get('METRICS_PORT'):
+            await start_metrics_server(registry, int(os.environ['METRICS_PORT']))
+            print(f"-- Metrics served at http://127.0.0.1:{os.environ['METRICS_PORT']}/metrics --")
+
+        if os.environ.get('METRICS_JSON_LOGS', 'False').lower() == 'true':
+            metrics.add_sink(JSONLogSink())
+
+    async def __fetch_guild_and_me(self) -> tuple[Guild, Member]:
+        guild = await self.fetch_guild(self.guild_id.id)
+        me = await guild.fetch_member(self.user.id)
+
+        return guild, me
+
+    async def __get_or_fetch_user(self, user_id: int) -> User:
+        return self.get_user(user_id) or await self.fetch_user(user_id)
+
+    async def __setup_mongo(self) -> tuple[int, list[list[str]]]:
+        """ Connects to Mongo and reads the config, returning the current school year and the classes. """
+
+        self.mongo_client = motor.AsyncIOMotorClient(os.environ['MONGO_URL'])
+        config_db = ConfigDB(self.mongo_client)
+
+        school_year, classes, _ = await asyncio.gather(
+            config_db.get_current_school_year(),
+            config_db.get_classes(),
+            ITIAPI.circuit_breaker.load(config_db)
+        )
+
+        return school_year, classes
+
+    async def __notify_circuit_breaker(self, old_state: str, state: str):
+        """ Notifies when the school site goes down or comes back (not at every probe while it's down). """
+
+        if state == CircuitBreaker.OPEN and old_state == CircuitBreaker.CLOSED:
+            retry_at = ITIAPI.circuit_breaker.get_retry_at()
+            await notify_owner(self, f"Il sito della scuola sembra irraggiungibile, controlli sospesi fino alle "
+                                     f"<t:{int(retry_at.timestamp())}:T> (poi verrà riprovato periodicamente)")
+
+        elif state == CircuitBreaker.CLOSED:
+            await notify_owner(self, "Il sito della scuola è di nuovo raggiungibile, controlli ripresi")
+
     async def on_ready(self):
         print(f'-- Logged in as {self.user} (ID: {self.user.id}) --')
 
+        # on_ready is dispatched again after every reconnection, the following must be done only once
+        if self.__ready_once:
+            return
+        self.__ready_once = True
+
         # Sync Slash Commands with Discord
         self.tree.copy_global_to(guild=self.guild_id)
         await self.tree.sync(guild=self.guild_id)
 
-        await self.change_presence(activity=Activity(
-            name="www.ispascalcomandini.it",
-            type=ActivityType.watching
-        ))
+        self.schedule_plots_generation()
+
+    def schedule_plots_generation(self) -> None:
+        """
+        Generates the plots in background (to be called when the variations change). If the plots are already being
+        generated, they are generated once more after the current generation.
+        """
+
+        self.__plots_outdated = True
+
+        if self.__plots_task is None or self.__plots_task.done():
+            self.__plots_task = create_background_task(self.__generate_plots())
+
+    async def __generate_plots(self):
+        # Imported here since matplotlib is slow to import and not needed to start the bot
+        from src.commands.analytics.plots import generate_plots
+
+        while self.__plots_outdated:
+            self.__plots_outdated = False
 
-        await generate_plots(self)
+            try:
+                await generate_plots(self)
+            except Exception as e:
+                print(f"Error generating plots: {e}")
 
     async def upgrade_school_year(self):
         config_db = ConfigDB(self.mongo_client)
 
         await config_db.upgrade_school_year()
         self.school_year += 1
-        self.analytics_view.update_school_year(self.school_year)
+        self.analytics.update_school_year(self.school_year)
 
         await self.select_class_view.set_classes(await config_db.get_classes())
 
         variations_db = VariationsDB(self.mongo_client, self.school_year)
         await variations_db.create_collection()
+        self.variations_window.update_school_year(variations_db)
 
-        await generate_plots(self)
+        self.schedule_plots_generation()
 
 
 async def main():
@@ -114,7 +214,9 @@ async def main():
     intents = Intents.default()
     intents.message_content = True
     intents.members = True
-    bot = ITIBot(command_prefix='!', description="ITI Blaise Pascal Discord Bot", intents=intents)
+    # The activity is passed here so that it's set again at every reconnection
+    bot = ITIBot(command_prefix='!', description="ITI Blaise Pascal Discord Bot", intents=intents,
+                 activity=Activity(name="www.ispascalcomandini.it", type=ActivityType.watching))
 
     async with bot:
         try:
@@ -1,61 +1,245 @@
-from asyncio import sleep
+import asyncio
+import random
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, TypeVar
 
 import aiohttp
 
+from src.api.iti.circuit_breaker import CircuitBreaker
+from src.utils.metrics import metrics
+from src.utils.pdf_utils import PDFBuffer, PDFTooLargeError
+
+T = TypeVar('T')
+
+# Time (event loop clock) by which the requests of the current budget must be completed, None if there's no budget
+_deadline: ContextVar[float | None] = ContextVar('iti_deadline', default=None)
+
 
 class ITIAPI:
     BASE_URL = "https://www.ispascalcomandini.it"
 
+    circuit_breaker = CircuitBreaker('iti')     # Fed by the requests of the variations page
+
+    CONNECT_TIMEOUT = 10        # seconds
+    READ_TIMEOUT = 30           # seconds without receiving data
+    REQUEST_TIMEOUT = 90        # seconds for a whole request
+
+    MAX_TRIES = 5
+    BACKOFF_BASE = 1            # seconds, doubled at each retry
+    BACKOFF_MAX = 20            # seconds
+
+    MAX_PDF_SIZE = 30 * 1024 * 1024     # bytes, larger PDFs are not downloaded
+    CHUNK_SIZE = 64 * 1024              # bytes read at a time while downloading
+
     @staticmethod
-    async def _request(endpoint: str, params: dict = None, method: str = "GET") -> str:
+    @asynccontextmanager
+    async def budget(seconds: float):
+        """
+        Limits the total time of the requests made in the block: request timeouts and retries are shortened to fit the
+        remaining time, and the requests still running when it runs out are cancelled (raising TimeoutError).
+
+        :param seconds: The time available
+        """
+
+        deadline = asyncio.get_running_loop().time() + seconds
+
+        # A budget inside another one can't go beyond it
+        outer_deadline = _deadline.get()
+        if outer_deadline is not None:
+            deadline = min(deadline, outer_deadline)
+
+        token = _deadline.set(deadline)
+        try:
+            async with asyncio.timeout_at(deadline):
+                yield
+        finally:
+            _deadline.reset(token)
+
+    @staticmethod
+    def _get_remaining_time() -> float | None:
+        """
+        Get the time left in the current budget.
+
+        :return: The seconds left, None if there's no budget
+        """
+
+        deadline = _deadline.get()
+        return None if deadline is None else deadline - asyncio.get_running_loop().time()
+
+    @staticmethod
+    def _get_timeout() -> aiohttp.ClientTimeout:
+        """
+        Get the timeout of a request, within the current budget.
+
+        :return: The timeout
+        """
+
+        total = ITIAPI.REQUEST_TIMEOUT
+
+        remaining = ITIAPI._get_remaining_time()
+        if remaining is not None:
+            total = max(min(total, remaining), 0.1)
+
+        return aiohttp.ClientTimeout(total=total, sock_connect=ITIAPI.CONNECT_TIMEOUT, sock_read=ITIAPI.READ_TIMEOUT)
+
+    @staticmethod
+    async def _with_retries(request: Callable[[int], Awaitable[T]], circuit_breaker: CircuitBreaker = None) -> T:
+        """
+        Makes a request, retrying on network errors, timeouts and server errors with exponential backoff and jitter,
+        as long as there's time left in the current budget.
+
+        If a circuit breaker is given, the request (with all its retries) is recorded in it as a single outcome, and
+        while the circuit is open no request is made and CircuitOpenError is raised.
+
+        :param request: The function making the request, called with the number of the attempt (starting from 1)
+        :param circuit_breaker: The circuit breaker of the requested service, if any
+        :return: The result of the request
+        """
+
+        if circuit_breaker is None:
+            return await ITIAPI.__retry(request)
+
+        token = circuit_breaker.before_request()
+
+        try:
+            result = await ITIAPI.__retry(request)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Client errors (e.g. 404) mean the site is up
+            if ITIAPI.__is_client_error(e):
+                circuit_breaker.record_success(token)
+            else:
+                circuit_breaker.record_failure(token)
+            raise
+        except BaseException:
+            circuit_breaker.record_cancel(token)
+            raise
+        else:
+            circuit_breaker.record_success(token)
+            return result
+
+    @staticmethod
+    async def __retry(request: Callable[[int], Awaitable[T]]) -> T:
+        """
+        Makes a request, retrying it with exponential backoff and jitter (see `_with_retries`).
+
+        :param request: The function making the request, called with the number of the attempt (starting from 1)
+        :return: The result of the request
+        """
+
+        for attempt in range(1, ITIAPI.MAX_TRIES + 1):
+            try:
+                return await request(attempt)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Client errors (e.g. 404) won't change retrying
+                if ITIAPI.__is_client_error(e) or attempt == ITIAPI.MAX_TRIES:
+                    raise
+
+                delay = random.uniform(0, min(ITIAPI.BACKOFF_MAX, ITIAPI.BACKOFF_BASE * 2 ** (attempt - 1)))
+
+                # Not enough time for another attempt
+                remaining = ITIAPI._get_remaining_time()
+                if remaining is not None and remaining <= delay:
+                    raise TimeoutError(f"Request budget exhausted after {attempt} attempts") from e
+
+                metrics.inc('itibot_request_retries_total', labels={'error': e.__class__.__name__})
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def __is_client_error(e: Exception) -> bool:
+        """ Whether the error is a client error response (4xx except 429 Too Many Requests). """
+
+        return isinstance(e, aiohttp.ClientResponseError) and e.status < 500 and e.status != 429
+
+    @staticmethod
+    def _check_status(response: aiohttp.ClientResponse) -> None:
+        """
+        Raises ClientResponseError if the response is not 2xx.
+
+        :param response: The response to check
+        """
+
+        if response.status < 200 or response.status >= 300:
+            raise aiohttp.ClientResponseError(
+                request_info=response.request_info,
+                history=response.history,
+                status=response.status,
+                message=f"Error fetching {response.url}: {response.reason}"
+            )
+
+    @staticmethod
+    async def _request(endpoint: str, params: dict = None, method: str = "GET",
+                       circuit_breaker: CircuitBreaker = None) -> str:
         """
         Makes a GET request to the specified endpoint and returns the response text.
 
         :param endpoint: The API endpoint to request.
         :param params: Optional parameters for the request.
         :param method: The HTTP method to use for the request (default is "GET").
+        :param circuit_breaker: If given, the request is recorded in it (see `_with_retries`).
         :return: The response text from the API.
         """
 
         url = f"{ITIAPI.BASE_URL}{endpoint}"
 
-        async with aiohttp.ClientSession() as session:
-            async with session.request(method, url, params=params, ssl=False) as response:
-                # Check if response is class 2xx
-                if response.status < 200 or response.status >= 300:
-                    raise aiohttp.ClientResponseError(
-                        request_info=response.request_info,
-                        history=response.history,
-                        status=response.status,
-                        message=f"Error fetching {url}: {response.reason}"
-                    )
+        async def request(_) -> str:
+            async with aiohttp.ClientSession(timeout=ITIAPI._get_timeout()) as session:
+                async with session.request(method, url, params=params, ssl=False) as response:
+                    ITIAPI._check_status(response)
+                    return await response.text()
 
-                return await response.text()
+        return await ITIAPI._with_retries(request, circuit_breaker)
 
     @staticmethod
-    async def _download_pdf(url: str) -> bytes:
+    async def _download_pdf(url: str) -> PDFBuffer:
         """
         Downloads a PDF file from the specified endpoint.
 
         :param url: The API endpoint to download the PDF from.
-        :return: The content of the downloaded PDF file as bytes.
+        :return: The content of the downloaded PDF file (to be closed by the caller).
         """
 
-        pdf = None
-        tries = 0
+        pdf, _ = await ITIAPI._download_pdf_with_date(url)
+        return pdf
 
-        while tries < 5:
-            try:
-                async with aiohttp.ClientSession() as session:
+    @staticmethod
+    async def _download_pdf_with_date(url: str) -> tuple[PDFBuffer, datetime | None]:
+        """
+        Downloads a PDF file from the specified endpoint, with its last modification date.
+        The PDF is streamed into a buffer (spooled to disk when large), PDFTooLargeError is raised if it's larger than
+        MAX_PDF_SIZE.
+
+        :param url: The API endpoint to download the PDF from.
+        :return: The content of the downloaded PDF file (to be closed by the caller) and its Last-Modified date (None if
+                 not sent).
+        """
+
+        async def download(attempt: int) -> tuple[PDFBuffer, datetime | None]:
+            with metrics.timed('download', url=url, attempt=attempt):
+                async with aiohttp.ClientSession(timeout=ITIAPI._get_timeout()) as session:
                     async with session.get(url, ssl=False) as response:
-                        pdf = await response.read()
-            except aiohttp.ClientError:
-                tries += 1
-                await sleep(3)
-            else:
-                break
+                        ITIAPI._check_status(response)
+
+                        # Refused before downloading it when the size is known
+                        if response.content_length is not None and response.content_length > ITIAPI.MAX_PDF_SIZE:
+                            raise PDFTooLargeError(f"PDF at {url} is {response.content_length} bytes")
+
+                        pdf = await PDFBuffer.from_stream(response.content.iter_chunked(ITIAPI.CHUNK_SIZE),
+                                                          ITIAPI.MAX_PDF_SIZE)
+
+                        try:
+                            last_modified = parsedate_to_datetime(response.headers['Last-Modified'])
+                        except (KeyError, TypeError, ValueError):
+                            last_modified = None
+
+                        return pdf, last_modified
+
+        pdf, last_modified = await ITIAPI._with_retries(download)
 
         if not pdf:
+            pdf.close()
             raise Exception("Could not download PDF")
 
-        return pdf
+        return pdf, last_modified
@@ -0,0 +1,194 @@
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from src.mongo_db.config_db import ConfigDB
+from src.utils.metrics import metrics
+from src.utils.utils import create_background_task
+
+
+class CircuitOpenError(Exception):
+    """ Raised instead of making a request while the service is considered down. """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops the requests to a service that is down, probing it again after a cool-down.
+
+    - closed: requests are made, and their outcomes recorded in a window. When enough of them fail, the circuit opens.
+    - open: requests fail immediately with CircuitOpenError until the cool-down has passed.
+    - half-open: a single request probes the service. If it succeeds the circuit closes, otherwise it opens again with
+      a doubled cool-down.
+
+    The state is saved to the database (when loaded with `load`) and listeners are called on each state change.
+
+    Each request gets a token from `before_request`, to be passed when recording its outcome: outcomes of requests
+    started before the last state change are ignored (e.g. the requests still running when the circuit opened), so
+    only the probe settles the half-open state.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, window: int = 20, min_requests: int = 5, failure_rate: float = 0.5,
+                 cool_down: float = 5 * 60, max_cool_down: float = 60 * 60):
+        """
+        :param name: The name of the circuit breaker (used to save its state)
+        :param window: The number of recent requests considered
+        :param min_requests: The requests needed in the window before opening the circuit
+        :param failure_rate: The share of failed requests in the window that opens the circuit
+        :param cool_down: The seconds to wait before the first probe
+        :param max_cool_down: The maximum seconds between probes
+        """
+
+        self.name = name
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.base_cool_down = cool_down
+        self.max_cool_down = max_cool_down
+
+        self.state = self.CLOSED
+        self.opened_at: datetime | None = None
+        self.cool_down = cool_down
+
+        self.__outcomes: deque[bool] = deque(maxlen=window)
+        self.__generation = 0       # Incremented at each state change, used as token of the requests
+        self.__probing = False
+        self.__config_db: ConfigDB | None = None
+        self.__listeners: list[Callable[[str, str], Awaitable[None]]] = []
+
+    async def load(self, config_db: ConfigDB) -> None:
+        """
+        Restores the saved state and saves the next state changes.
+
+        :param config_db: The database where the state is saved
+        """
+
+        self.__config_db = config_db
+
+        saved = await config_db.get_circuit_breaker(self.name)
+        if saved:
+            self.state = saved['state']
+            self.cool_down = saved['cool_down']
+            self.opened_at = saved['opened_at'].replace(tzinfo=timezone.utc) if saved['opened_at'] else None
+
+            # A probe interrupted by the restart
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def add_listener(self, listener: Callable[[str, str], Awaitable[None]]) -> None:
+        """
+        Adds a function called (in background) on each state change, with the old and the new state.
+
+        :param listener: The async function to call
+        """
+
+        self.__listeners.append(listener)
+
+    def get_retry_at(self) -> datetime | None:
+        """
+        Get when the service will be probed again.
+
+        :return: The time of the next probe, None if the circuit is not open
+        """
+
+        return self.opened_at + timedelta(seconds=self.cool_down) if self.state == self.OPEN else None
+
+    def before_request(self) -> int:
+        """
+        To be called before each request, raises CircuitOpenError if the request must not be made.
+
+        :return: The token of the request, to be passed when recording its outcome
+        """
+
+        if self.state == self.OPEN:
+            if datetime.now(timezone.utc) < self.get_retry_at():
+                raise CircuitOpenError(f"{self.name} is down, next try at {self.get_retry_at()}")
+
+            self.__set_state(self.HALF_OPEN)
+
+        if self.state == self.HALF_OPEN:
+            # Only one probe at a time
+            if self.__probing:
+                raise CircuitOpenError(f"{self.name} is being probed")
+
+            self.__probing = True
+
+        return self.__generation
+
+    def record_success(self, token: int) -> None:
+        """
+        To be called when a request succeeds (the service answered).
+
+        :param token: The token of the request
+        """
+
+        if token != self.__generation:
+            return
+
+        if self.state == self.HALF_OPEN:
+            self.cool_down = self.base_cool_down
+            self.__set_state(self.CLOSED)
+        else:
+            self.__outcomes.append(True)
+
+    def record_failure(self, token: int) -> None:
+        """
+        To be called when a request fails because of the service (network error, timeout or server error).
+
+        :param token: The token of the request
+        """
+
+        if token != self.__generation:
+            return
+
+        if self.state == self.HALF_OPEN:
+            self.cool_down = min(self.cool_down * 2, self.max_cool_down)
+            self.__set_state(self.OPEN)
+            return
+
+        self.__outcomes.append(False)
+
+        failures = self.__outcomes.count(False)
+        if len(self.__outcomes) >= self.min_requests and failures / len(self.__outcomes) >= self.failure_rate:
+            self.__set_state(self.OPEN)
+
+    def record_cancel(self, token: int) -> None:
+        """
+        To be called when a request is cancelled before its outcome is known (a probe can be made again).
+
+        :param token: The token of the request
+        """
+
+        if token == self.__generation and self.state == self.HALF_OPEN:
+            self.__probing = False
+
+    def __set_state(self, state: str) -> None:
+        old_state, self.state = self.state, state
+
+        self.__generation += 1
+        self.__probing = False
+
+        if state == self.OPEN:
+            self.opened_at = datetime.now(timezone.utc)
+        elif state == self.CLOSED:
+            self.opened_at = None
+            self.__outcomes.clear()
+
+        metrics.inc('itibot_circuit_transitions_total', labels={'circuit': self.name, 'state': state})
+        print(f"Circuit breaker {self.name}: {old_state} -> {state}")
+
+        create_background_task(self.__on_state_change(old_state, state))
+
+    async def __on_state_change(self, old_state: str, state: str) -> None:
+        # The current state is saved (not the one of this change), so quick consecutive changes can't save a stale one
+        if self.__config_db is not None:
+            await self.__config_db.set_circuit_breaker(self.name, self.state, self.opened_at, self.cool_down)
+
+        for listener in self.__listeners:
+            try:
+                await listener(old_state, state)
+            except Exception as e:
+                print(f"Error in circuit breaker listener: {e}")
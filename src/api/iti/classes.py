@@ -26,6 +26,7 @@ class ClassesAPI(ITIAPI):
         classes_pdf = await ITIAPI._download_pdf(link)
         if classes_pdf is None:
             raise ValueError(f"Failed to download PDF from {link}")
+        classes_pdf.close()
 
         with open("assets/classes.pdf", "rb") as f:
             classes_pdf = f.read()
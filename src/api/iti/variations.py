@@ -1,93 +1,180 @@
+import asyncio
 import datetime
-import re
+import hashlib
+import time
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 from src.api.iti._iti_ import ITIAPI
+from src.api.iti.circuit_breaker import CircuitOpenError
 from src.api.iti.variations_parsers.excel_ui import ExcelUIParser
 from src.api.iti.variations_parsers.new_ui import NewUIParser
 from src.api.iti.variations_parsers.ocr import OCRParser
 from src.api.iti.variations_parsers.old_ui import OldUIParser
 from src.models.variation import Variation
-from src.utils.datetime_utils import parse_italian_date
+from src.models.variation_link import VariationLink
+from src.mongo_db.pdf_events_db import PDFEventsDB
+from src.utils.metrics import metrics
+from src.utils.pdf_utils import PDFBuffer
 
 
 class VariationsAPI(ITIAPI):
     __VARIATIONS_PATH = "/pagine/variazioni-orario-istituto-tecnico-tecnologico-1"
     __DIV_ID = 'maincontent'
+    PDF_LINKS_PREFIX = 'https://cspace.spaggiari.eu/pub/FOIP0004/'
+
+    # The page of the last fetch and its links, the page is parsed again only when it changes
+    __page_hash: bytes | None = None
+    __page_links: list[VariationLink] = []
 
     @staticmethod
-    async def get_variations_links() -> list[str]:
+    async def get_variations_links() -> list[VariationLink]:
         """
         It gets the links of the PDF files from the ITI page
 
-        :return: A list of strings, each string is a link to a PDF file.
+        :return: A list of links to the PDF files, with their date and part number.
         """
 
         try:
-            iti_page = await ITIAPI._request(VariationsAPI.__VARIATIONS_PATH)
+            with metrics.timed('links_fetch'):
+                # Only the page checked at every tick feeds the circuit breaker (a broken PDF link doesn't mean the site
+                # is down)
+                iti_page = await ITIAPI._request(VariationsAPI.__VARIATIONS_PATH, circuit_breaker=ITIAPI.circuit_breaker)
+        except (TimeoutError, CircuitOpenError):
+            # Out of time budget or site down, the caller decides what to do with the check
+            raise
         except Exception as e:
             print(f"Error fetching ITI page: {e}")
             return []
 
-        soup = BeautifulSoup(iti_page, 'html.parser')
+        page_hash = hashlib.sha256(iti_page.encode()).digest()
+        if page_hash == VariationsAPI.__page_hash:
+            metrics.inc('itibot_links_page_total', labels={'changed': 'false'})
+            return list(VariationsAPI.__page_links)
+
+        links = VariationsAPI.__extract_links(iti_page)
 
-        # Get <a> elements of the page
-        a = soup.find(id=VariationsAPI.__DIV_ID).find_all('a')
+        VariationsAPI.__page_hash = page_hash
+        VariationsAPI.__page_links = links
+        metrics.inc('itibot_links_page_total', labels={'changed': 'true'})
+
+        return list(links)
+
+    @staticmethod
+    def __extract_links(iti_page: str) -> list[VariationLink]:
+        """
+        It extracts the links of the PDF files from the main content of the ITI page.
+
+        :param iti_page: The HTML of the ITI page.
+        :return: A list of links to the PDF files.
+        """
+
+        # Only the main content is parsed, the rest of the page is skipped
+        soup = BeautifulSoup(iti_page, 'html.parser', parse_only=SoupStrainer(id=VariationsAPI.__DIV_ID))
 
         # Get PDF links from <a> elements
-        links: list[str] = [link.get('href') for link in a]
+        links: list[str] = [a.get('href') for a in soup.find_all('a')]
 
         # Filter out links that do not match the conditions
         conditions = [
             lambda link: link is not None,
-            lambda link: link.startswith('https://cspace.spaggiari.eu/pub/FOIP0004/'),
-            lambda link: 'parte2' not in link,
+            lambda link: link.startswith(VariationsAPI.PDF_LINKS_PREFIX),
             lambda link: 'aule' not in link
         ]
 
-        return [link for link in links if all(condition(link) for condition in conditions)]
+        return [VariationLink.from_url(link) for link in links if all(condition(link) for condition in conditions)]
 
     @staticmethod
-    async def get_variations(*links: str) -> list[Variation] | None:
+    async def get_variations(*links: VariationLink, events_db: PDFEventsDB = None) -> list[Variation] | None:
         """
         It fetches the variations from the given links and returns a list of Variation objects.
+        The parts of the same day (e.g. "... parte2.pdf") are downloaded and parsed concurrently, then merged into one
+        list without duplicates. If a part fails the whole day is skipped, since its variations would be incomplete.
 
         :param links: A list of links to the PDF files containing variations.
+        :param events_db: If given, each download is recorded in it (first seen, content changes, parser used, ...).
         :return: A list of Variation objects or None if no variations are found (e.g., if all parsing methods fail).
         """
 
-        variations = []
+        days: dict[datetime.datetime, list[VariationLink]] = {}
         for link in links:
-            date = VariationsAPI.__get_date_from_link(link)
+            if link.date is None:
+                print(f"Skipping link {link.url}, date not found in its name")
+                continue
 
-            try:
-                pdf = await ITIAPI._download_pdf(link)
-                if pdf is None:
-                    print(f"Failed to download PDF from {link}")
-                    continue
+            days.setdefault(link.date, []).append(link)
 
-                pdf_variations = await VariationsAPI.__parse_pdf(pdf)
-                VariationsAPI.__set_variations_date(pdf_variations, date)
+        variations = []
+        for date, day_links in days.items():
+            day_links.sort(key=lambda day_link: day_link.part)
 
-                variations.extend(pdf_variations)
-            except Exception as e:
-                print(f"Error processing link {link}: {e}")
+            results = await asyncio.gather(*(VariationsAPI.__get_part_variations(link, events_db)
+                                             for link in day_links), return_exceptions=True)
+
+            # Out of time budget or site down, the caller decides what to do with the check
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+
+            failed = [link.part for link, result in zip(day_links, results) if result is None]
+            if failed:
+                print(f"Skipping variations of {date:%d/%m/%Y}, failed parts: {failed}")
+                continue
+
+            # Merge the parts, a variation repeated in more parts is kept once (from the first part)
+            day_variations: dict[tuple, Variation] = {}
+            for part_variations in results:
+                for variation in part_variations:
+                    day_variations.setdefault(variation.key, variation)
+
+            if len(day_links) > 1:
+                print(f"Variations of {date:%d/%m/%Y} merged from parts {[link.part for link in day_links]} "
+                      f"({len(day_variations)} variations, "
+                      f"{sum(map(len, results)) - len(day_variations)} duplicates)")
+
+            variations.extend(day_variations.values())
 
         return variations
 
     @staticmethod
-    def __get_date_from_link(link: str) -> datetime.datetime:
+    async def __get_part_variations(link: VariationLink, events_db: PDFEventsDB = None) -> list[Variation] | None:
         """
-        Extracts the date from the link.
+        It downloads and parses the PDF of a link, setting the date of its variations.
 
-        :param link: The link to extract the date from.
-        :return: The date in 'dd-mm-yyyy' format.
+        :param link: The link to the PDF file.
+        :param events_db: If given, the download is recorded in it.
+        :return: A list of Variation objects, or None if the PDF couldn't be downloaded or parsed.
         """
-        date = link.split('/')[-1][:-4].lower()
-        date = re.search(r'\d+\s+\w+', date).group(0)  # Extracts the date part
 
-        return parse_italian_date(date)
+        try:
+            pdf, last_modified = await ITIAPI._download_pdf_with_date(link.url)
+            if pdf is None:
+                print(f"Failed to download PDF from {link.url}")
+                return None
+
+            # The PDF is freed as soon as it's parsed, not kept until all links are done
+            with pdf:
+                start = time.perf_counter()
+                pdf_variations, parser = await VariationsAPI.__parse_pdf(pdf)
+                parse_duration = time.perf_counter() - start
+
+                content_hash = hashlib.sha256(pdf.view).hexdigest()
+
+            if events_db is not None:
+                await events_db.record(link.url, link.date, content_hash, parser, parse_duration,
+                                       len(pdf_variations or []), last_modified)
+
+            if pdf_variations is None:
+                return None
+
+            VariationsAPI.__set_variations_date(pdf_variations, link.date)
+
+            return pdf_variations
+        except (TimeoutError, CircuitOpenError):
+            raise
+        except Exception as e:
+            print(f"Error processing link {link.url}: {e}")
+            return None
 
     @staticmethod
     def __set_variations_date(variations: list[Variation], date: datetime.datetime):
@@ -101,12 +188,12 @@ class VariationsAPI(ITIAPI):
             variation.set_date(date)
 
     @staticmethod
-    async def __parse_pdf(pdf: bytes) -> list[Variation] | None:
+    async def __parse_pdf(pdf: PDFBuffer) -> tuple[list[Variation] | None, str | None]:
         """
         Parses the PDF content using different methods until one succeeds.
 
-        :param pdf: The PDF content as bytes.
-        :return: A list of Variation objects or None if parsing fails.
+        :param pdf: The PDF content.
+        :return: A list of Variation objects (or None if parsing fails) and the name of the parser that succeeded.
         """
 
         parsers = [ExcelUIParser(), NewUIParser(), OldUIParser(), OCRParser()]
@@ -115,9 +202,9 @@ class VariationsAPI(ITIAPI):
             try:
                 variations = await parser(pdf)
                 if variations:
-                    return variations
+                    return variations, parser.__class__.__name__
             except Exception as e:
                 print(f"Error parsing with {parser.__class__.__name__}: {e}")
 
         print("All methods failed to parse the PDF.")
-        return None
+        return None, None
@@ -1,7 +1,8 @@
 from abc import abstractmethod, ABC
 
 from src.models.variation import Variation
-from src.utils.pdf_utils import rotate_pdf
+from src.utils.metrics import metrics
+from src.utils.pdf_utils import PDFBuffer, rotate_pdf
 from src.utils.utils import to_thread
 
 
@@ -10,42 +11,49 @@ class PDFParser(ABC):
     An abstract base class for parsing PDF files to extract variations.
     """
 
-    async def __call__(self, pdf: bytes) -> list[Variation] | None:
+    async def __call__(self, pdf: PDFBuffer) -> list[Variation] | None:
         """
         Allows the parser to be called as a function.
 
-        :param pdf: The PDF file as bytes.
+        :param pdf: The PDF file.
         :return: A list of Variation objects or None if parsing fails.
         """
         return await self._try_all_rotation_parsing(pdf)
 
     @abstractmethod
     @to_thread
-    def _parse(self, pdf: bytes) -> list[Variation] | None:
+    def _parse(self, pdf: PDFBuffer) -> list[Variation] | None:
         """
         Parses the PDF and returns a list of variations.
 
-        :param pdf: The PDF file as bytes.
+        :param pdf: The PDF file.
         :return: A list of Variation objects or None if parsing fails.
         """
         pass
 
-    async def _try_all_rotation_parsing(self, pdf: bytes) -> list[Variation] | None:
+    async def _try_all_rotation_parsing(self, pdf: PDFBuffer) -> list[Variation] | None:
         """
         Parses the PDF by trying all possible rotations (0, 90, 180, 270 degrees).
+        Each rotated copy is made only if the previous rotations failed, and freed right after being parsed.
 
-        :param pdf: The PDF file as bytes.
+        :param pdf: The PDF file.
         :return: A list of Variation objects or None if parsing fails.
         """
 
         for rotation in range(0, 360, 90):
+            rotated_pdf = None
+
             try:
-                rotated_pdf = rotate_pdf(pdf, rotation_degrees=rotation)
+                with metrics.timed('parse', {'parser': self.__class__.__name__}, rotation=rotation):
+                    rotated_pdf = rotate_pdf(pdf, rotation_degrees=rotation)
 
-                variations = await self._parse(rotated_pdf)
+                    variations = await self._parse(rotated_pdf)
                 if variations:
                     return variations
             except Exception as e:
                 print(f"Error during parsing with rotation {rotation}: {e}")
+            finally:
+                if rotated_pdf is not None and rotated_pdf is not pdf:
+                    rotated_pdf.close()
 
         return None
@@ -2,7 +2,7 @@ from enum import Enum
 
 from src.api.iti.variations_parsers._parser_ import PDFParser
 from src.models.variation import Variation
-from src.utils.pdf_utils import get_rows_from_pdf_table
+from src.utils.pdf_utils import PDFBuffer, get_rows_from_pdf_table
 from src.utils.utils import to_thread
 
 
@@ -24,11 +24,11 @@ class NewUIParser(PDFParser):
         self._required_headers = {'Ora', 'Classe', 'Docente assente', 'Sostituto 1', 'Sostituto 2', 'Note'}
 
     @to_thread
-    def _parse(self, pdf: bytes) -> list[Variation] | None:
+    def _parse(self, pdf: PDFBuffer) -> list[Variation] | None:
         """
         Parses the PDF content and returns a list of variations.
 
-        :param pdf: The PDF content as bytes.
+        :param pdf: The PDF content.
         :return: A list of Variation objects or None if parsing fails.
         """
 
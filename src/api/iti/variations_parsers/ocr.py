@@ -1,21 +1,28 @@
 import gc
+import threading
 import traceback
 from datetime import datetime
 from pathlib import Path
-
-import pandas as pd
-from paddleocr import TableRecognitionPipelineV2
+from typing import TYPE_CHECKING
 
 from src.api.iti.variations_parsers._parser_ import PDFParser
 from src.models.variation import Variation
+from src.utils.metrics import metrics
 from src.utils.os_utils import clear_folder
-from src.utils.pdf_utils import save_pdf
+from src.utils.pdf_utils import PDFBuffer, save_pdf
 from src.utils.utils import to_thread
 
+# pandas and paddleocr are heavy to import, so they are imported only when the OCR is used
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 class OCRParser(PDFParser):
     _pipeline = None
 
+    # The pipeline and the temporary folder are shared, so one PDF is processed at a time (e.g. the parts of a day)
+    _lock = threading.Lock()
+
     def __init__(self):
         super().__init__()
         self.__required_headers = {'Ora', 'Classe', 'Aula', 'Docente assente', 'Sostituto 1', 'Sostituto 2', 'Note'}
@@ -23,6 +30,8 @@ class OCRParser(PDFParser):
     @staticmethod
     def _get_pipeline():
         if OCRParser._pipeline is None:
+            from paddleocr import TableRecognitionPipelineV2
+
             try:
                 OCRParser._pipeline = TableRecognitionPipelineV2(
                     text_detection_model_name="PP-OCRv5_server_det",
@@ -36,11 +45,16 @@ class OCRParser(PDFParser):
                 raise e
         return OCRParser._pipeline
 
-    async def _try_all_rotation_parsing(self, pdf: bytes) -> list[Variation] | None:
-        return await self._parse(pdf)
+    async def _try_all_rotation_parsing(self, pdf: PDFBuffer) -> list[Variation] | None:
+        with metrics.timed('ocr'):
+            return await self._parse(pdf)
 
     @to_thread
-    def _parse(self, pdf: bytes) -> list[Variation] | None:
+    def _parse(self, pdf: PDFBuffer) -> list[Variation] | None:
+        with self._lock:
+            return self.__parse_locked(pdf)
+
+    def __parse_locked(self, pdf: PDFBuffer) -> list[Variation] | None:
         now = datetime.now()
         pdf_path = f'assets/tmp-ocr/{now.timestamp()}.pdf'
 
@@ -95,10 +109,12 @@ class OCRParser(PDFParser):
         :return: A DataFrame containing the data from the XLSX files.
         """
 
+        import pandas as pd
+
         dataframes = [pd.read_excel(file) for file in xlsx_files]
         return pd.concat(dataframes, ignore_index=True)
 
-    def __check_headers(self, df: pd.DataFrame) -> bool:
+    def __check_headers(self, df: 'pd.DataFrame') -> bool:
         """
         Checks if the DataFrame contains the required headers.
 
@@ -110,7 +126,7 @@ class OCRParser(PDFParser):
         return self.__required_headers.issubset(headers)
 
     @staticmethod
-    def __parse_dataframe(df: pd.DataFrame) -> list[Variation]:
+    def __parse_dataframe(df: 'pd.DataFrame') -> list[Variation]:
         """
         Parses the DataFrame and converts it into a list of Variation objects.
 
@@ -1,7 +1,11 @@
 import io
+from typing import TYPE_CHECKING
 
 import aiohttp
-import pandas as pd
+
+# pandas is heavy to import and it's needed only once a year, so it's imported on first use
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class MIMClasses:
@@ -21,7 +25,7 @@ class MIMClasses:
         return set(df['AnnoCorso'].astype(str) + df['SezioneAnno'])
 
     @staticmethod
-    async def __run_query(query: str) -> pd.DataFrame:
+    async def __run_query(query: str) -> 'pd.DataFrame':
         """
         It runs a query on the MIM API and returns the result as a DataFrame.
 
@@ -29,6 +33,8 @@ class MIMClasses:
         :return: A dictionary containing the result of the query.
         """
 
+        import pandas as pd
+
         url = f"{MIMClasses.__BASE_URL}/query?query={query}&dataType=csv"
 
         async with aiohttp.ClientSession() as session:
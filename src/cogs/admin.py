@@ -1,6 +1,13 @@
-from discord import app_commands
+from typing import Literal
+
+from discord import app_commands, Embed, Color
 from discord.ext.commands import Cog
 
+from src.api.iti._iti_ import ITIAPI
+from src.commands.analytics.archive import archive_school_year, ArchiveError, ArchivesAnalytics, get_archived_years
+from src.loops.new_year.create_variations_channels import create_variations_channels
+from src.mongo_db.config_db import ConfigDB
+
 
 async def setup(bot):
     await bot.add_cog(Admin(bot))
@@ -25,3 +32,87 @@ class Admin(Cog):
             await itr.channel.purge(limit=n)
 
         await itr.edit_original_response(content="Messaggi cancellati")
+
+    @app_commands.command(name="sincronizza_canali", description="ADMIN ONLY")
+    @app_commands.describe(dry_run="Mostra solo le modifiche senza applicarle")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def sync_channels(self, itr, dry_run: bool = True):
+        await itr.response.defer(ephemeral=True)
+
+        grouped_classes = await ConfigDB(self.bot.mongo_client).get_classes()
+        plan = await create_variations_channels(self.bot, grouped_classes, dry_run=dry_run)
+
+        status = "Nessuna modifica necessaria" if plan.is_empty() else str(plan)
+        await itr.edit_original_response(content=f"```\n{status}\n```"[:2000])
+
+    @app_commands.command(name="prossimo_controllo", description="ADMIN ONLY")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def next_check(self, itr):
+        scheduler = self.bot.get_cog('DailyLoops').scheduler
+        next_run = f"<t:{int(scheduler.next_run.timestamp())}:T>" if scheduler.next_run else "non ancora pianificato"
+
+        retry_at = ITIAPI.circuit_breaker.get_retry_at()
+        site_status = f"irraggiungibile, nuovo tentativo alle <t:{int(retry_at.timestamp())}:T>" if retry_at \
+            else ITIAPI.circuit_breaker.state
+
+        await itr.response.send_message(
+            content=f"Intervallo attuale: {scheduler.interval / 60:.1f} minuti\n"
+                    f"Prossimo controllo: {next_run}\n"
+                    f"Controlli senza variazioni di fila: {scheduler.unchanged_streak}\n"
+                    f"Sito della scuola: {site_status}",
+            ephemeral=True
+        )
+
+    @app_commands.command(name="archivia_anno", description="ADMIN ONLY")
+    @app_commands.describe(anno="Anno scolastico da archiviare (es. 25 per il 2024/2025)")
+    @app_commands.describe(collezione="Cosa fare della collezione dopo l'archiviazione")
+    @app_commands.describe(sovrascrivi="Sostituisce l'archivio esistente dell'anno")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def archive_year(self, itr, anno: int, collezione: Literal['mantieni', 'riduci', 'elimina'] = 'mantieni',
+                           sovrascrivi: bool = False):
+        if anno >= self.bot.school_year:
+            await itr.response.send_message(content="Si possono archiviare solo gli anni scolastici conclusi", ephemeral=True)
+            return
+
+        await itr.response.defer(ephemeral=True)
+
+        mode = {'mantieni': 'keep', 'riduci': 'shrink', 'elimina': 'drop'}[collezione]
+        try:
+            rows = await archive_school_year(self.bot.mongo_client, anno, mode, overwrite=sovrascrivi)
+        except ArchiveError as e:
+            await itr.edit_original_response(content=f"Anno {anno - 1}/{anno} non archiviato: {e}")
+            return
+
+        await itr.edit_original_response(content=f"Anno {anno - 1}/{anno} archiviato: {rows} variazioni")
+
+    @app_commands.command(name="confronto_anni", description="ADMIN ONLY")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def compare_years(self, itr):
+        if not get_archived_years():
+            await itr.response.send_message(content="Nessun anno archiviato", ephemeral=True)
+            return
+
+        await itr.response.defer(ephemeral=True)
+
+        analytics = ArchivesAnalytics()
+        totals = await analytics.get_totals()
+        classes = await analytics.get_classes_trend()
+        teachers = await analytics.get_teachers_trend()
+        months = await analytics.get_monthly_trend()
+
+        lines = []
+        for year, total in totals.items():
+            top_class = max(classes, key=lambda name: classes[name].get(year, 0), default=None)
+            top_teacher = max(teachers, key=lambda name: teachers[name].get(year, 0), default=None)
+            top_month = max(months[year], key=months[year].get)
+
+            lines.append(f"**{year - 1}/{year}**: {total} variazioni\n"
+                         f"Classe: **{top_class}** ({classes.get(top_class, {}).get(year, 0)}) - "
+                         f"Prof.: **{top_teacher}** ({teachers.get(top_teacher, {}).get(year, 0)}) - "
+                         f"Mese di picco: **{top_month}** ({months[year][top_month]})")
+
+        await itr.edit_original_response(embed=Embed(
+            title="Confronto anni scolastici",
+            description="\n\n".join(lines)[:4096],
+            color=Color.gold()
+        ))
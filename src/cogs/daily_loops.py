@@ -6,13 +6,14 @@ import pytz
 from discord.ext import tasks
 from discord.ext.commands import Cog
 
+from src.api.iti.circuit_breaker import CircuitOpenError
 from src.api.iti.variations import VariationsAPI
-from src.loops.check_variations.classify_variations import classify_variations
-from src.loops.check_variations.create_embeds import create_variations_embeds
-from src.loops.check_variations.group_variations import group_variations_by_class
-from src.loops.check_variations.send_embeds import send_grouped_embeds
-from src.mongo_db.variations_db import VariationsDB
+from src.loops.check_variations.check_variations import FETCH_BUDGET, run_variations_check
+from src.loops.check_variations.scheduler import CheckScheduler
+from src.loops.check_variations.send_embeds import send_outbox
+from src.mongo_db.config_db import ConfigDB
 from src.utils.datetime_utils import is_christmas, is_school_over
+from src.utils.metrics import metrics
 
 
 async def setup(bot):
@@ -22,8 +23,13 @@ async def setup(bot):
 class DailyLoops(Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.scheduler = CheckScheduler(ConfigDB(bot.mongo_client))
 
         self.loops_controller.start()
+        self.outbox_sender.start()
+
+    async def cog_load(self):
+        await self.scheduler.load()
 
     @tasks.loop(hours=12)
     async def loops_controller(self):
@@ -51,38 +57,28 @@ class DailyLoops(Cog):
 
     @tasks.loop(minutes=15)
     async def check_variations(self):
-        """ Check for new variations, notify users and save them to the database. """
+        """ Check for new variations, notify users and save them to the database, then plan the next check. """
 
         now = datetime.now(pytz.timezone('Europe/Rome'))
+        changed = False
 
-        if 0 < now.hour < 6:
-            print(f"[{now}] Skipping Variations Check (0 < now hour < 6)")
-            return
-
-        print(f"[{now}] Checking Variations")
-
-        variations_db = VariationsDB(self.bot.mongo_client, self.bot.school_year)
-
-        links = await VariationsAPI.get_variations_links()
-        variations = await VariationsAPI.get_variations(*links)
-
-        await classify_variations(self.bot, variations)
-        if not variations:
-            print(f"[{now}] No new variations")
-            return
-
-        grouped_variations: dict[str, list] = group_variations_by_class(variations)
-
-        # Create embeds for each class
-        grouped_embeds = {}
-        for class_name, class_vars in grouped_variations.items():
-            grouped_embeds[class_name] = create_variations_embeds(*class_vars)
+        try:
+            if now.hour in CheckScheduler.QUIET_HOURS:
+                print(f"[{now}] Skipping Variations Check (quiet hours)")
+            else:
+                with metrics.timed('check'):
+                    changed = await run_variations_check(self.bot, now)
+        finally:
+            interval = await self.scheduler.on_check(now, changed)
+            self.check_variations.change_interval(seconds=interval)
 
-        await send_grouped_embeds(self.bot, grouped_embeds)
+            print(f"[{now}] Next Variations Check at {self.scheduler.next_run} (in {interval / 60:.1f} minutes)")
 
-        await variations_db.save_variations(variations)
+    @tasks.loop(minutes=1)
+    async def outbox_sender(self):
+        """ Send the pending messages of the outbox (retries and messages left by a crash). """
 
-        print(f"[{now}] Variations Check complete, {len(variations)} variations processed")
+        await send_outbox(self.bot)
 
     # Check every day at 20:00 if variations have been detected for the next day
     @tasks.loop(time=time(20))
@@ -97,15 +93,26 @@ class DailyLoops(Cog):
 
         print(f"[{now}] Checking Variations Sent")
 
-        db = VariationsDB(self.bot.mongo_client, self.bot.school_year)
-        tomorrow_var = await db.get_variations_by_date(tomorrow.date())
+        tomorrow_var = await self.bot.variations_window.get_variations_by_date(tomorrow.date())
 
         # If variations exist for tomorrow, do nothing
         if tomorrow_var:
             return
 
         # If we are here, there are no variations for tomorrow, so we check if there's any link in ITI page
-        if await VariationsAPI.get_variations_links():
+        # An error escaping the loop would stop it, so the check is skipped if the site is down or too slow
+        try:
+            async with VariationsAPI.budget(FETCH_BUDGET):
+                links = await VariationsAPI.get_variations_links()
+        except TimeoutError:
+            print(f"[{now}] Variations Sent Check aborted, fetching took more than {FETCH_BUDGET} seconds")
+            return
+        except CircuitOpenError as e:
+            # The owner has already been notified that the site is down
+            print(f"[{now}] Variations Sent Check skipped, school site down ({e})")
+            return
+
+        if links:
             embed = discord.Embed(
                 title="Sembrano non esserci variazioni per domani...",
                 description="Controlla manualmente [nel sito](https://www.ispascalcomandini.it/variazioni-orario-istituto-tecnico-tecnologico/2017/09/15/) per sicurezza!",
@@ -117,3 +124,7 @@ class DailyLoops(Cog):
     @loops_controller.before_loop
     async def before_loops_controller(self):
         await self.bot.wait_until_ready()
+
+    @outbox_sender.before_loop
+    async def before_outbox_sender(self):
+        await self.bot.wait_until_ready()
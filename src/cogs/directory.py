@@ -0,0 +1,47 @@
+from discord.ext.commands import Cog
+
+
+async def setup(bot):
+    await bot.add_cog(Directory(bot))
+
+
+class Directory(Cog):
+    """ Keeps the guild directory (roles and channels index) updated with the gateway events. """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @Cog.listener()
+    async def on_guild_available(self, guild):
+        if guild.id == self.bot.guild.id:
+            self.bot.directory.load(guild)
+
+    @Cog.listener()
+    async def on_guild_role_create(self, role):
+        if role.guild.id == self.bot.guild.id:
+            self.bot.directory.add_role(role)
+
+    @Cog.listener()
+    async def on_guild_role_delete(self, role):
+        if role.guild.id == self.bot.guild.id:
+            self.bot.directory.remove_role(role)
+
+    @Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        if after.guild.id == self.bot.guild.id:
+            self.bot.directory.update_role(before, after)
+
+    @Cog.listener()
+    async def on_guild_channel_create(self, channel):
+        if channel.guild.id == self.bot.guild.id:
+            self.bot.directory.add_channel(channel)
+
+    @Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        if channel.guild.id == self.bot.guild.id:
+            self.bot.directory.remove_channel(channel)
+
+    @Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        if after.guild.id == self.bot.guild.id:
+            self.bot.directory.update_channel(before, after)
@@ -1,26 +1,27 @@
 import os
+import statistics
 
 import discord
 from discord import ui, ButtonStyle, Embed, Color, SelectOption
 
-from src.mongo_db.variations_db import VariationsDB
+from src.commands.analytics.engine import AnalyticsEngine
+from src.mongo_db.pdf_events_db import PDFEventsDB
 
 weekdays = ["Domenica", "Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato"]
 months = ["Gennaio", "Febbraio", "Marzo", "Aprile", "Maggio", "Giugno", "Luglio", "Agosto", "Settembre", "Ottobre", "Novembre", "Dicembre"]
 
 
 class AnalyticsView(ui.View):
-    def __init__(self, mongo_client, school_year):
+    def __init__(self, mongo_client, analytics: AnalyticsEngine):
         super().__init__(timeout=None)
         self.mongo_client = mongo_client
-        self.db = VariationsDB(mongo_client, school_year)
+        self.db = analytics
+        self.events_db = PDFEventsDB(mongo_client)
 
         self.add_item(ClassesScoreboard())
         self.add_item(ProfessorsScoreboard())
         self.add_item(DatetimeStats())
-
-    def update_school_year(self, school_year):
-        self.db = VariationsDB(self.mongo_client, school_year)
+        self.add_item(PublicationStats())
 
 
 class DatetimeStats(ui.Button):
@@ -61,14 +62,45 @@ class DatetimeStats(ui.Button):
         )
 
 
+class PublicationStats(ui.Button):
+    def __init__(self):
+        super().__init__(style=ButtonStyle.blurple, label="Statistiche pubblicazione", custom_id="publication_stats")
+
+    async def callback(self, interaction):
+        first_seen_hours = await self.view.events_db.get_first_seen_hours()
+        lags = await self.view.events_db.get_detection_lags()
+
+        # Text histogram of the hours in which the PDFs have been published
+        max_count = max(first_seen_hours.values()) or 1
+        histogram = "\n".join([f"`{hour:02d}:00` {'█' * round(count / max_count * 15)} {count}"
+                               for hour, count in first_seen_hours.items() if count])
+
+        if lags:
+            lags_text = f"Mediano: **{statistics.median(lags) / 60:.1f}** minuti\n" \
+                        f"Medio: **{statistics.mean(lags) / 60:.1f}** minuti\n" \
+                        f"Massimo: **{max(lags) / 60:.1f}** minuti"
+        else:
+            lags_text = "Nessun dato"
+
+        await interaction.response.send_message(            # noqa
+            embed=Embed(
+                title="Statistiche pubblicazione",
+                description=f"**Ore di pubblicazione dei PDF**\n{histogram or 'Nessun dato'}\n\n"
+                            f"**Ritardo di rilevamento** (dalla pubblicazione nel sito)\n{lags_text}",
+                color=Color.gold()
+            ),
+            ephemeral=True
+        )
+
+
 class ProfessorsScoreboard(ui.Button):
     def __init__(self):
         super().__init__(style=ButtonStyle.blurple, label="Classifica prof.", custom_id="professors_scoreboard")
 
     async def callback(self, interaction):
-        scoreboard = await self.view.db.get_professors_leaderboard()
+        scoreboard = await self.view.db.get_professors_leaderboard(limit=10)
 
-        leaderboard_text = "\n".join([f"{index + 1}. **{item['_id']}** - {item['count']} ore di assenza" for index, item in enumerate(scoreboard[:10])])
+        leaderboard_text = "\n".join([f"{index + 1}. **{item['_id']}** - {item['count']} ore di assenza" for index, item in enumerate(scoreboard)])
 
         await interaction.response.send_message(            # noqa
             embed=Embed(
@@ -86,12 +118,12 @@ class ClassesScoreboard(ui.Button):
         super().__init__(style=ButtonStyle.blurple, label="Classifica classi", custom_id="classes_scoreboard")
 
     async def callback(self, interaction):
-        scoreboard = await self.view.db.get_classes_leaderboard()
+        scoreboard = await self.view.db.get_classes_leaderboard(limit=10)
 
         await interaction.response.send_message(            # noqa
             embed=Embed(
                 title="Top 10 classi con più prof. assenti",
-                description="\n".join([f"{index + 1}. **{item['_id']}** - {item['count']} sostituzioni" for index, item in enumerate(scoreboard[:10])]),
+                description="\n".join([f"{index + 1}. **{item['_id']}** - {item['count']} sostituzioni" for index, item in enumerate(scoreboard)]),
                 color=Color.gold()
             ),
             ephemeral=True
@@ -0,0 +1,245 @@
+import os
+import re
+from typing import TYPE_CHECKING, Literal
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from src.mongo_db.variations_db import VariationsDB
+from src.utils.utils import to_thread
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+ARCHIVE_FOLDER = 'assets/archive'
+SCHEMA_VERSION = '1'
+BATCH_SIZE = 10_000     # Variations written to the file at a time
+
+# Fields removed from the live collection when it's shrunk (the ones used by the analytics are kept)
+DETAIL_FIELDS = ['classroom', 'substitute_1', 'substitute_2', 'notes']
+
+
+class ArchiveError(Exception):
+    """ Raised when a school year can't be archived (the existing archive is kept). """
+    pass
+
+
+def get_schema() -> 'pa.Schema':
+    """
+    The schema of the archives, the same for every school year.
+
+    :return: The Arrow schema
+    """
+
+    import pyarrow as pa
+
+    return pa.schema([
+        ('date', pa.date32()),
+        ('hour', pa.int8()),
+        ('class', pa.string()),
+        ('teacher', pa.string()),
+        ('classroom', pa.string()),
+        ('substitute_1', pa.string()),
+        ('substitute_2', pa.string()),
+        ('notes', pa.string())
+    ])
+
+
+def get_archive_path(school_year: int) -> str:
+    return f"{ARCHIVE_FOLDER}/variations{school_year}.parquet"
+
+
+def get_archived_years() -> list[int]:
+    """
+    Get the school years with an archive.
+
+    :return: The school years, ordered
+    """
+
+    if not os.path.isdir(ARCHIVE_FOLDER):
+        return []
+
+    return sorted(int(file[len('variations'):-len('.parquet')]) for file in os.listdir(ARCHIVE_FOLDER)
+                  if file.startswith('variations') and file.endswith('.parquet'))
+
+
+async def archive_school_year(mongo_client: AsyncIOMotorClient, school_year: int,
+                              mode: Literal['keep', 'shrink', 'drop'] = 'keep', overwrite: bool = False) -> int:
+    """
+    Streams the variations of a finished school year from Mongo to a compressed Parquet file, then optionally shrinks
+    (removing the fields not used by the analytics) or drops the collection.
+
+    Once the collection is shrunk or dropped the archive is the only full copy, so ArchiveError is raised (keeping the
+    archive) if the collection is missing or shrunk, if the year is already archived (unless `overwrite`) and if the
+    new archive would have fewer variations than the existing one.
+
+    :param mongo_client: The Mongo client
+    :param school_year: The school year to archive
+    :param mode: What to do with the collection after the export ('keep', 'shrink' or 'drop')
+    :param overwrite: Whether to replace an existing archive of the school year
+    :return: The number of variations archived
+    """
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    variations_db = VariationsDB(mongo_client, school_year)
+    collection = variations_db.variations_collection
+
+    path = get_archive_path(school_year)
+
+    if os.path.exists(path) and not overwrite:
+        raise ArchiveError(f"School year {school_year} is already archived")
+
+    if collection.name not in await mongo_client['ITI'].list_collection_names():
+        raise ArchiveError(f"Collection of school year {school_year} not found")
+
+    # A shrunk collection has no details left (e.g. the classroom) to archive
+    if await collection.find_one({'variations.0': {'$exists': True}, 'variations.classroom': {'$exists': False}},
+                                 {'_id': 1}):
+        raise ArchiveError(f"Collection of school year {school_year} has already been shrunk")
+    os.makedirs(ARCHIVE_FOLDER, exist_ok=True)
+
+    schema = get_schema().with_metadata({'school_year': str(school_year), 'schema_version': SCHEMA_VERSION})
+    writer = pq.ParquetWriter(f"{path}.tmp", schema, compression='zstd')
+
+    rows = 0
+    columns = {name: [] for name in schema.names}
+
+    async def write_batch():
+        batch = pa.RecordBatch.from_pydict(columns, schema=schema)
+        await to_thread(writer.write_batch)(batch)
+
+        for values in columns.values():
+            values.clear()
+
+    try:
+        async for batch in variations_db.iter_rows(batch_size=BATCH_SIZE):
+            for row in batch:
+                columns['date'].append(row['date'].date())
+                columns['hour'].append(row.get('hour') if isinstance(row.get('hour'), int) else None)
+                columns['class'].append(row.get('class'))
+                columns['teacher'].append(row.get('teacher'))
+
+                for field in DETAIL_FIELDS:
+                    columns[field].append(row.get(field))
+
+            rows += len(batch)
+            await write_batch()
+    finally:
+        writer.close()
+
+    # Replace the archive only when it's complete, and never with fewer variations
+    if pq.read_metadata(f"{path}.tmp").num_rows != rows:
+        os.remove(f"{path}.tmp")
+        raise RuntimeError(f"Archive of school year {school_year} is incomplete")
+
+    if os.path.exists(path) and pq.read_metadata(path).num_rows > rows:
+        os.remove(f"{path}.tmp")
+        raise ArchiveError(f"The existing archive of school year {school_year} has more variations than the collection")
+
+    os.replace(f"{path}.tmp", path)
+
+    match mode:
+        case 'shrink':
+            await collection.update_many({}, {'$unset': {f'variations.$[].{field}': '' for field in DETAIL_FIELDS}})
+        case 'drop':
+            await collection.drop()
+
+    return rows
+
+
+class ArchivesAnalytics:
+    """
+    Cross-year analytics computed from the archives (memory-mapped, without querying the database).
+    """
+
+    def __init__(self, school_years: list[int] = None):
+        self.school_years = school_years if school_years is not None else get_archived_years()
+
+    @to_thread
+    def get_totals(self) -> dict[int, int]:
+        """
+        Get the number of variations of each school year.
+
+        :return: Dict containing the number of variations per school year
+        """
+
+        import pyarrow.parquet as pq
+
+        return {year: pq.read_metadata(get_archive_path(year)).num_rows for year in self.school_years}
+
+    @to_thread
+    def get_classes_trend(self) -> dict[str, dict[int, int]]:
+        """
+        Get the number of variations of each class in each school year (classes with a valid name, e.g. 4A).
+
+        :return: Dict containing, for each class, the number of variations per school year
+        """
+
+        trend = {}
+
+        for year in self.school_years:
+            for class_name, count in self.__count(year, 'class').items():
+                if re.match(r'^[0-9][A-Z]+$', class_name):
+                    trend.setdefault(class_name, {})[year] = count
+
+        return trend
+
+    @to_thread
+    def get_teachers_trend(self) -> dict[str, dict[int, int]]:
+        """
+        Get the number of variations of each teacher in each school year.
+
+        :return: Dict containing, for each teacher, the number of variations per school year
+        """
+
+        trend = {}
+
+        for year in self.school_years:
+            for teacher, count in self.__count(year, 'teacher').items():
+                # Filter out teachers with less than 3 characters in their name (usually errors)
+                if len(teacher) > 2:
+                    trend.setdefault(teacher, {})[year] = count
+
+        return trend
+
+    @to_thread
+    def get_monthly_trend(self) -> dict[int, dict[int, int]]:
+        """
+        Get the number of variations per month in each school year.
+
+        :return: Dict containing, for each school year, the number of variations per month (1-12)
+        """
+
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        trend = {}
+
+        for year in self.school_years:
+            months = pc.month(self.__read(year, ['date'])['date'])
+            counts = pa.table({'month': months}).group_by('month').aggregate([('month', 'count')]).to_pylist()
+
+            counts = {item['month']: item['month_count'] for item in counts}
+            trend[year] = {month: counts.get(month, 0) for month in range(1, 13)}
+
+        return trend
+
+    @classmethod
+    def __count(cls, school_year: int, column: str) -> dict[str, int]:
+        """ Count the variations of a school year for each value of a column (null values excluded). """
+
+        # Each row group has its own dictionary
+        table = cls.__read(school_year, [column]).drop_null().unify_dictionaries()
+        counts = table.group_by(column).aggregate([(column, 'count')])
+
+        return dict(zip(counts[column].to_pylist(), counts[f'{column}_count'].to_pylist()))
+
+    @staticmethod
+    def __read(school_year: int, columns: list[str]) -> 'pa.Table':
+        """ Read some columns of an archive, memory-mapping the file. """
+
+        import pyarrow.parquet as pq
+
+        return pq.read_table(get_archive_path(school_year), columns=columns, memory_map=True,
+                             read_dictionary=[column for column in columns if column in ('class', 'teacher')])
@@ -0,0 +1,355 @@
+import asyncio
+from datetime import date
+from typing import TYPE_CHECKING
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from src.models.variation import Variation
+from src.mongo_db.variations_db import VariationsDB
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+EPOCH = date(1970, 1, 1)
+
+
+class AnalyticsEngine:
+    """
+    Computes the analytics of a school year in memory, from a columnar snapshot of its variations (class and teacher
+    as categoricals, date as days since epoch, hour as int8) loaded once from Mongo and updated when new variations are
+    saved, instead of running an aggregation on the collection for each stat.
+
+    It exposes the analytics methods of `VariationsDB`, with the same results.
+    pandas and numpy are imported on first use, since they are slow to import.
+    """
+
+    CLASS_PATTERN = r'^[0-9][A-Z]+$'
+
+    def __init__(self, mongo_client: AsyncIOMotorClient, school_year: int):
+        self.mongo_client = mongo_client
+        self.school_year = school_year
+
+        self.__snapshot: 'pd.DataFrame | None' = None
+        self.__documents_days: set[int] = set()     # Days with a document in the collection (for weekday averages)
+
+        self.__lock = asyncio.Lock()
+        self.__loading = False
+        self.__stale = False
+
+    def update_school_year(self, school_year: int) -> None:
+        """
+        Switches to another school year, the snapshot is loaded again on the next query.
+
+        :param school_year: The new school year
+        """
+
+        self.school_year = school_year
+        self.__snapshot = None
+        self.__documents_days = set()
+
+    def apply(self, variations: list[Variation]) -> None:
+        """
+        Updates the snapshot with the variations just saved to the database (new variations are appended and removed
+        ones dropped, edited variations don't change the analytics).
+
+        :param variations: The saved variations (with their type)
+        """
+
+        if self.__snapshot is None:
+            return
+
+        # The snapshot being loaded may not include these variations, reload it on the next query
+        if self.__loading:
+            self.__stale = True
+            return
+
+        import pandas as pd
+
+        new = [var for var in variations if var.type == 'new' and var.date]
+        removed = [var for var in variations if var.type == 'removed' and var.date]
+
+        snapshot = self.__snapshot
+
+        if removed:
+            snapshot = snapshot[~self.__get_mask(snapshot, removed)]
+
+        if new:
+            days = [self.__get_day(var.date) for var in new]
+            appended = self.__create_frame(days, [var.class_name for var in new], [var.teacher for var in new],
+                                           [var.hour for var in new])
+
+            # Same categories in both frames, so the columns stay categorical after concat
+            snapshot = snapshot.copy()
+            for column in ('class', 'teacher'):
+                missing = appended[column].cat.categories.difference(snapshot[column].cat.categories)
+                snapshot[column] = snapshot[column].cat.add_categories(missing)
+                appended[column] = appended[column].cat.set_categories(snapshot[column].cat.categories)
+
+            snapshot = pd.concat([snapshot, appended], ignore_index=True)
+            self.__documents_days.update(days)
+
+        self.__snapshot = snapshot
+
+    async def get_classes_leaderboard(self, limit: int = None) -> list:
+        """
+        Get the scoreboard for the classes, ordered by the number of variations for each class
+
+        :param limit: The maximum number of classes, None for all
+        :return: The scoreboard
+        """
+
+        counts = self.__get_classes_counts(await self.__get_snapshot())
+        return self.__to_scoreboard(counts, 'count', limit)
+
+    async def get_variations_per_class_age(self, class_age: int, limit: int = None) -> list:
+        """
+        Get the variations for the given class age (e.g. 4A, 4B, 4C... for class_age = 4)
+
+        :param class_age: The class age to get the variations for
+        :param limit: The maximum number of classes, None for all
+        :return: The variations for the given class age
+        """
+
+        counts = self.__get_counts(await self.__get_snapshot(), 'class')
+        counts = counts[counts.index.astype(str).str.match(f'^{class_age}[A-Z]+')]
+
+        return self.__to_scoreboard(counts, 'variations', limit)
+
+    async def get_variations_summary(self) -> dict:
+        """
+        Get the variations grouped by class age (e.g. 4A, 4B, 4C... are all grouped in 4)
+
+        :return: The variations grouped by class age, ordered by class age
+        """
+
+        counts = self.__get_classes_counts(await self.__get_snapshot())
+        summary = counts.groupby(counts.index.astype(str).str[0]).sum().sort_index()
+
+        return {class_age: int(count) for class_age, count in summary.items()}
+
+    async def get_classes_count(self, scoreboard=None) -> dict:
+        """
+        Get the number of classes grouped by class age
+
+        :return: The number of classes grouped by class age
+        """
+
+        if scoreboard is not None:
+            class_ages = sorted(item['_id'][0] for item in scoreboard)
+            return {class_age: class_ages.count(class_age) for class_age in dict.fromkeys(class_ages)}
+
+        counts = self.__get_classes_counts(await self.__get_snapshot())
+        classes_count = counts.groupby(counts.index.astype(str).str[0]).size().sort_index()
+
+        return {class_age: int(count) for class_age, count in classes_count.items()}
+
+    async def get_professors_leaderboard(self, limit: int = None) -> list:
+        """
+        Get the scoreboard for each professor
+
+        :param limit: The maximum number of professors, None for all
+        :return: The scoreboard for each professor
+        """
+
+        counts = self.__get_counts(await self.__get_snapshot(), 'teacher')
+
+        # Filter out teachers with less than 3 characters in their name (usually errors)
+        counts = counts[counts.index.astype(str).str.len() > 2]
+
+        return self.__to_scoreboard(counts, 'count', limit)
+
+    async def get_yearly_stats(self) -> dict:
+        """
+        Get the yearly stats (number of variations per month)
+
+        :return: Dict containing the length of variations per month ordered by month
+        """
+
+        import numpy as np
+
+        snapshot = await self.__get_snapshot()
+        counts = np.bincount(snapshot['month'].to_numpy(), minlength=13)
+
+        return {month: int(counts[month]) for month in range(1, 13)}
+
+    async def get_monthly_stats(self, month: int) -> dict:
+        """
+        Get the monthly stats (number of variations per day)
+
+        :param month: The month to get the stats for
+        :return: Dict containing the length of variations per day ordered by day
+        """
+
+        import numpy as np
+
+        snapshot = await self.__get_snapshot()
+        days = snapshot['day_of_month'].to_numpy()[snapshot['month'].to_numpy() == month]
+        counts = np.bincount(days, minlength=32)
+
+        return {day: int(counts[day]) for day in range(1, 32)}
+
+    async def get_weekday_stats(self) -> dict:
+        """
+        Get the weekday stats (number of variations per weekday), each weekday divided by the number of documents in
+        the DB for that weekday
+
+        :return: Dict containing the length of variations per weekday ordered by weekday (1 = Sunday)
+        """
+
+        import numpy as np
+
+        snapshot = await self.__get_snapshot()
+
+        variations_count = np.bincount(snapshot['weekday'].to_numpy(), minlength=8)
+        documents_count = np.bincount(self.__get_weekdays(np.fromiter(self.__documents_days, dtype=np.int32)),
+                                      minlength=8)
+
+        return {weekday: int(variations_count[weekday]) / int(documents_count[weekday]) if documents_count[weekday]
+                else int(variations_count[weekday]) for weekday in range(1, 8)}
+
+    async def get_hourly_stats(self) -> dict:
+        """
+        Get the hourly stats (number of variations per hour)
+
+        :return: Dict containing the length of variations per hour ordered by hour (at least 1-6 inclusive)
+        """
+
+        import numpy as np
+
+        snapshot = await self.__get_snapshot()
+
+        hours = snapshot['hour'].to_numpy()
+        counts = np.bincount(hours[hours >= 0], minlength=7)
+
+        return {hour: int(counts[hour]) for hour in range(1, len(counts)) if hour <= 6 or counts[hour]}
+
+    async def __get_snapshot(self) -> 'pd.DataFrame':
+        """
+        Get the snapshot of the school year, loading it from the database if needed.
+
+        :return: The snapshot (a row for each variation)
+        """
+
+        async with self.__lock:
+            while self.__snapshot is None or self.__stale:
+                self.__stale = False
+                self.__loading = True
+
+                try:
+                    self.__snapshot, self.__documents_days = await self.__load()
+                finally:
+                    self.__loading = False
+
+            return self.__snapshot
+
+    async def __load(self) -> tuple['pd.DataFrame', set[int]]:
+        """
+        Load the variations of the school year from the database (only the fields used by the analytics).
+
+        :return: The snapshot and the days with a document
+        """
+
+        collection = VariationsDB(self.mongo_client, self.school_year).variations_collection
+        cursor = collection.find({}, {'_id': 0, 'date': 1, 'variations.class': 1, 'variations.teacher': 1,
+                                      'variations.hour': 1})
+
+        documents_days = set()
+        days, classes, teachers, hours = [], [], [], []
+
+        async for doc in cursor:
+            day = self.__get_day(doc['date'])
+            documents_days.add(day)
+
+            for var in doc.get('variations', []):
+                days.append(day)
+                classes.append(var.get('class'))
+                teachers.append(var.get('teacher'))
+                hours.append(var.get('hour'))
+
+        return self.__create_frame(days, classes, teachers, hours), documents_days
+
+    @classmethod
+    def __create_frame(cls, days: list[int], classes: list[str], teachers: list[str], hours: list[int]) -> 'pd.DataFrame':
+        """
+        Create the columnar representation of the variations.
+
+        :param days: The dates of the variations as days since epoch
+        :param classes: The classes of the variations
+        :param teachers: The teachers of the variations
+        :param hours: The hours of the variations
+        :return: The DataFrame with a row for each variation
+        """
+
+        import numpy as np
+        import pandas as pd
+
+        days = np.asarray(days, dtype=np.int32)
+        months = days.astype('datetime64[D]').astype('datetime64[M]')
+
+        return pd.DataFrame({
+            'day': days,
+            'month': (months.astype(np.int64) % 12 + 1).astype(np.int8),
+            'day_of_month': (days - months.astype('datetime64[D]').astype(np.int64) + 1).astype(np.int8),
+            'weekday': cls.__get_weekdays(days),
+            'class': pd.Categorical(classes),
+            'teacher': pd.Categorical(teachers),
+            'hour': np.asarray([hour if isinstance(hour, int) else -1 for hour in hours], dtype=np.int8)
+        })
+
+    @staticmethod
+    def __get_day(day: date) -> int:
+        """ Convert a date (or datetime) to days since epoch. """
+
+        return (date(day.year, day.month, day.day) - EPOCH).days
+
+    @staticmethod
+    def __get_weekdays(days):
+        """ Get the weekdays of days since epoch, as Mongo $dayOfWeek (1 = Sunday, 1970-01-01 was a Thursday). """
+
+        import numpy as np
+
+        return ((days + 4) % 7 + 1).astype(np.int8)
+
+    @staticmethod
+    def __get_mask(snapshot: 'pd.DataFrame', variations: list[Variation]):
+        """
+        Get the rows of the snapshot matching the variations (same date, class, teacher and hour).
+
+        :param snapshot: The snapshot
+        :param variations: The variations to match
+        :return: A boolean array, True for the matching rows
+        """
+
+        import numpy as np
+
+        days = snapshot['day'].to_numpy()
+        hours = snapshot['hour'].to_numpy()
+
+        mask = np.zeros(len(snapshot), dtype=bool)
+        for var in variations:
+            mask |= ((days == AnalyticsEngine.__get_day(var.date)) & (hours == var.hour)
+                     & (snapshot['class'] == var.class_name).to_numpy()
+                     & (snapshot['teacher'] == var.teacher).to_numpy())
+
+        return mask
+
+    @staticmethod
+    def __get_counts(snapshot: 'pd.DataFrame', column: str) -> 'pd.Series':
+        """ Count the variations for each value of a categorical column, without unused categories. """
+
+        counts = snapshot[column].value_counts(sort=False)
+        return counts[counts > 0]
+
+    @classmethod
+    def __get_classes_counts(cls, snapshot: 'pd.DataFrame') -> 'pd.Series':
+        """ Count the variations for each class, only valid class names (e.g. 4A). """
+
+        counts = cls.__get_counts(snapshot, 'class')
+        return counts[counts.index.astype(str).str.match(cls.CLASS_PATTERN)]
+
+    @staticmethod
+    def __to_scoreboard(counts: 'pd.Series', count_key: str, limit: int = None) -> list:
+        """ Convert the counts to a scoreboard like the ones of the Mongo aggregations, ordered by count. """
+
+        counts = counts.sort_values(ascending=False, kind='stable')[:limit]
+        return [{'_id': str(name), count_key: int(count)} for name, count in counts.items()]
@@ -5,7 +5,6 @@ from datetime import datetime
 import matplotlib.pyplot as plt
 from discord import File
 
-from src.mongo_db.variations_db import VariationsDB
 from src.utils.os_utils import clear_folder
 
 weekdays = ["Domenica", "Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato"]
@@ -27,7 +26,7 @@ async def generate_plots(bot) -> list[File]:
         for folder in folders:
             clear_folder(folder)
 
-        db = VariationsDB(bot.mongo_client, bot.school_year)
+        db = bot.analytics
 
         # Classes plots
         for class_age in range(1, 6):
@@ -100,11 +99,11 @@ async def plot_variations_per_month(db):
 
 
 async def plot_professors_scoreboard(db):
-    scoreboard = await db.get_professors_leaderboard()
+    scoreboard = await db.get_professors_leaderboard(limit=20)
 
     # Create a barchart
-    y_values = [item['count'] for item in scoreboard[:20]]
-    plt.bar([item['_id'] for item in scoreboard[:20]], y_values)
+    y_values = [item['count'] for item in scoreboard]
+    plt.bar([item['_id'] for item in scoreboard], y_values)
 
     set_plot_config("Top 20 prof più assenti", "Prof.", "Ore di assenza", rotation=90)
 
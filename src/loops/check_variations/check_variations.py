@@ -0,0 +1,79 @@
+from datetime import datetime
+
+from src.api.iti.circuit_breaker import CircuitOpenError
+from src.api.iti.variations import VariationsAPI
+from src.loops.check_variations.classify_variations import classify_variations
+from src.loops.check_variations.create_embeds import create_variations_embeds
+from src.loops.check_variations.group_variations import group_variations_by_class
+from src.loops.check_variations.prune_links import prune_links
+from src.loops.check_variations.send_embeds import enqueue_grouped_embeds, send_outbox
+from src.mongo_db.outbox_db import OutboxDB
+from src.mongo_db.pdf_events_db import PDFEventsDB
+from src.utils.metrics import metrics
+from src.utils.utils import create_background_task
+
+FETCH_BUDGET = 4 * 60   # seconds to fetch the links and download/parse the PDFs (less than the shortest check interval)
+
+
+async def run_variations_check(bot, now: datetime) -> bool:
+    """
+    Check for new variations, notify users and save them to the database.
+
+    :param bot: The bot instance
+    :param now: The time of the check
+    :return: True if there were new, edited or removed variations, False otherwise
+    """
+
+    print(f"[{now}] Checking Variations")
+
+    # A stalled school site must not delay the next check: downloads still running when the budget runs out are
+    # cancelled and the check is skipped (a partial download would look like removed variations)
+    try:
+        async with VariationsAPI.budget(FETCH_BUDGET):
+            links = await VariationsAPI.get_variations_links()
+            links = await prune_links(bot, links, now.date())
+            variations = await VariationsAPI.get_variations(*links, events_db=PDFEventsDB(bot.mongo_client))
+    except TimeoutError:
+        metrics.inc('itibot_fetch_budget_exceeded_total')
+        print(f"[{now}] Variations Check aborted, fetching took more than {FETCH_BUDGET} seconds")
+        return False
+    except CircuitOpenError as e:
+        print(f"[{now}] Variations Check skipped, school site down ({e})")
+        return False
+
+    with metrics.timed('diff'):
+        await classify_variations(bot, variations)
+
+    metrics.inc('itibot_checks_total', labels={'changed': str(bool(variations)).lower()})
+    if not variations:
+        print(f"[{now}] No new variations")
+        return False
+
+    grouped_variations: dict[str, list] = group_variations_by_class(variations)
+
+    # Create embeds for each class
+    grouped_embeds = {}
+    for class_name, class_vars in grouped_variations.items():
+        grouped_embeds[class_name] = create_variations_embeds(*class_vars)
+
+    # Write the messages in the outbox before saving, so they are not lost if something fails
+    outbox_keys = await enqueue_grouped_embeds(bot, grouped_embeds, grouped_variations)
+
+    with metrics.timed('mongo_save'):
+        await bot.variations_window.save_variations(variations)
+
+    # Released right after saving, entries left staged by a crash are recovered at startup (recover_staged_entries)
+    await OutboxDB(bot.mongo_client).release(*outbox_keys)
+    create_background_task(send_outbox(bot))
+
+    bot.analytics.apply(variations)
+
+    for var_type in ('new', 'edited', 'removed'):
+        metrics.inc('itibot_variations_total', sum(var.type == var_type for var in variations), {'type': var_type})
+
+    # Variations changed, so the plots are outdated
+    bot.schedule_plots_generation()
+
+    print(f"[{now}] Variations Check complete, {len(variations)} variations processed")
+
+    return True
@@ -1,7 +1,6 @@
-from datetime import datetime, date
+from datetime import date
 
 from src.models.variation import Variation
-from src.mongo_db.variations_db import VariationsDB
 
 
 async def classify_variations(bot, variations: list[Variation]) -> None:
@@ -18,13 +17,17 @@ async def classify_variations(bot, variations: list[Variation]) -> None:
         return
 
     variations_dates = get_variations_dates(variations)
-    variations_db = VariationsDB(bot.mongo_client, bot.school_year)
 
-    existing_variations = await variations_db.get_variations_by_date(*variations_dates)
+    existing_variations = await bot.variations_window.get_variations_by_date(*variations_dates)
+    existing_by_key: dict[tuple, Variation] = {}
+    for variation in existing_variations:
+        existing_by_key.setdefault(variation.key, variation)
+
+    new_keys = {variation.key for variation in variations}
 
     # Check for new or edited variations
     for new_variation in variations:
-        existing_variation = find_variation(existing_variations, new_variation.teacher, new_variation.class_name, new_variation.date, new_variation.hour)
+        existing_variation = existing_by_key.get(new_variation.key)
 
         # If no existing variation is found, it's a new variation
         if existing_variation is None:
@@ -40,9 +43,7 @@ async def classify_variations(bot, variations: list[Variation]) -> None:
 
     # Add removed variations to the list (variations that are in the database but not in the new list)
     for existing_variation in existing_variations:
-        new_variation = find_variation(variations, existing_variation.teacher, existing_variation.class_name, existing_variation.date, existing_variation.hour)
-
-        if new_variation is None:
+        if existing_variation.key not in new_keys:
             existing_variation.set_var_type('removed')
             variations.append(existing_variation)
 
@@ -59,25 +60,6 @@ def get_variations_dates(variations: list[Variation]) -> set[date]:
     return {variation.date.date() for variation in variations if variation.date}
 
 
-def find_variation(variations: list[Variation], teacher: str, class_name: str, date: datetime, hour: int) -> Variation | None:
-    """
-    Finds a variation in the list by class name, date, and hour.
-
-    :param variations: List of variations to search.
-    :param teacher: Teacher name to match.
-    :param class_name: Class name to match.
-    :param date: Date to match (only day, month, year are considered).
-    :param hour: Hour to match.
-    :return: The matching variation or None if not found.
-    """
-
-    for variation in variations:
-        if variation.teacher == teacher and variation.class_name == class_name and variation.date.date() == date.date() and variation.hour == hour:
-            return variation
-
-    return None
-
-
 def get_edited_fields(old_variation: Variation, new_variation: Variation) -> list[str]:
     """
     Compares two variations and returns a list of fields that have been edited.
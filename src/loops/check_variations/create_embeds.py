@@ -1,12 +1,19 @@
+from datetime import date
+
 from discord import Embed, Color
 from discord.utils import format_dt
 
 from src.models.variation import Variation
 
+EMBED_DESCRIPTION_LIMIT = 4096  # Discord limit of characters in an embed description
+
+OCR_FOOTER = "Variazione rilevata tramite OCR, potrebbe contenere errori, quindi controlla manualmente nel sito per sicurezza!"
+
 
 def create_variations_embeds(*variations: Variation) -> list[Embed]:
     """
-    It takes a list of Variation objects and returns a list of Embed objects
+    It takes a list of Variation objects and returns a list of Embed objects, merging the variations with the same date
+    and type in the same embed (split in more embeds only if the description would be too long)
 
     :param variations: A list of Variation objects
     :return: A list of Embed objects.
@@ -14,91 +21,178 @@ def create_variations_embeds(*variations: Variation) -> list[Embed]:
 
     embeds = []
 
-    for variation in variations:
-        embed = None
-        match variation.type:
+    for (_, var_type), group in group_variations_by_date_and_type(variations).items():
+        match var_type:
             case "new":
-                embed = create_new_embed(variation)
+                create_description = create_new_description
             case "removed":
-                embed = create_removed_embed(variation)
+                create_description = create_removed_description
             case "edited":
-                embed = create_edited_embed(variation)
+                create_description = create_edited_description
             case _:
                 continue
 
-        if embed and variation.ocr:
-            embed.set_footer(
-                text="Variazione rilevata tramite OCR, potrebbe contenere errori, quindi controlla manualmente nel sito per sicurezza!")
+        group.sort(key=lambda var: var.hour)
+        descriptions = [create_description(variation) for variation in group]
+
+        # The title and the footer describe only the variations of each embed, not the whole group
+        start = 0
+        for chunk in chunk_descriptions(descriptions):
+            chunk_variations = group[start:start + len(chunk)]
+            start += len(chunk)
+
+            embed = Embed(
+                title=create_title(chunk_variations[0], plural=len(chunk_variations) > 1),
+                description="\n".join(chunk),
+                color=get_color(var_type)
+            )
+
+            if any(variation.ocr for variation in chunk_variations):
+                embed.set_footer(text=OCR_FOOTER)
 
-        if embed:
             embeds.append(embed)
 
     return embeds
 
 
-def create_new_embed(variation: Variation) -> Embed:
+def group_variations_by_date_and_type(variations: tuple[Variation, ...]) -> dict[tuple[date, str], list[Variation]]:
     """
-    It creates an embed for a new variation
+    Groups variations by their date and type, keeping the order of first appearance.
 
-    :param variation: The Variation object to create the embed for
-    :return: An Embed object.
+    :param variations: A list of Variation objects
+    :return: A dictionary where keys are (date, type) and values are lists of Variation objects.
     """
 
-    title = f":tada: Nuova variazione del {format_dt(variation.date, 'D')}"
-    color = Color.green()
-    description = f":teacher: **Docente assente: {variation.teacher}**\n" \
-                  f"\t• **Ora:** {variation.hour}^\n" \
-                  f"\t• **Aula:** {variation.classroom}\n" \
-                  f"\t• **Sostituto:** {variation.substitute_1}\n" + \
-                  (f"\t• **Note:** {variation.notes}\n" if variation.notes else '')
-    embed = Embed(title=title, description=description, color=color)
+    grouped = {}
+
+    for var in variations:
+        key = (var.date.date(), var.type)
+
+        if key not in grouped:
+            grouped[key] = []
+
+        grouped[key].append(var)
 
-    return embed
+    return grouped
 
 
-def create_removed_embed(variation: Variation) -> Embed:
+def chunk_descriptions(descriptions: list[str]) -> list[list[str]]:
     """
-    It creates an embed for a removed variation
+    It splits the descriptions in chunks, each one fitting in a single embed description.
 
-    :param variation: The Variation object to create the embed for
-    :return: An Embed object.
+    :param descriptions: The descriptions of the variations
+    :return: A list of chunks of descriptions
     """
 
-    title = f":frowning2: È stata rimossa la variazione del {format_dt(variation.date, 'D')}"
-    color = Color.red()
-    description = f":teacher: **Docente rientrato: {variation.teacher}**\n" \
-                  f"\t• **Ora:** {variation.hour}^\n"
+    chunks = []
+    chunk = []
+    chunk_length = 0
 
-    embed = Embed(title=title, description=description, color=color)
+    for description in descriptions:
+        # +1 for the newline joining the descriptions
+        if chunk and chunk_length + len(description) + 1 > EMBED_DESCRIPTION_LIMIT:
+            chunks.append(chunk)
+            chunk = []
+            chunk_length = 0
 
-    return embed
+        chunk.append(description)
+        chunk_length += len(description) + 1
 
+    if chunk:
+        chunks.append(chunk)
 
-def create_edited_embed(variation: Variation) -> Embed:
+    return chunks
+
+
+def create_title(variation: Variation, plural: bool = False) -> str:
     """
-    It creates an embed for an edited variation
+    It creates the title of the embed for a variation type
 
-    :param variation: The Variation object to create the embed for
-    :return: An Embed object.
+    :param variation: The (first) Variation object of the embed
+    :param plural: Whether the embed contains more than one variation
+    :return: The title of the embed.
     """
 
-    title = f":pencil2: È stata modificata una variazione del {format_dt(variation.date, 'D')}"
-    color = Color.orange()
+    date_str = format_dt(variation.date, 'D')
+
+    match variation.type:
+        case "new":
+            return f":tada: Nuove variazioni del {date_str}" if plural else f":tada: Nuova variazione del {date_str}"
+        case "removed":
+            return f":frowning2: Sono state rimosse delle variazioni del {date_str}" if plural \
+                else f":frowning2: È stata rimossa la variazione del {date_str}"
+        case "edited":
+            return f":pencil2: Sono state modificate delle variazioni del {date_str}" if plural \
+                else f":pencil2: È stata modificata una variazione del {date_str}"
+
+    return ""
+
+
+def get_color(var_type: str) -> Color:
+    """
+    It returns the color of the embed for a variation type
+
+    :param var_type: The variation type ('new', 'removed', 'edited')
+    :return: A Color object.
+    """
+
+    match var_type:
+        case "new":
+            return Color.green()
+        case "removed":
+            return Color.red()
+        case _:
+            return Color.orange()
+
+
+def create_new_description(variation: Variation) -> str:
+    """
+    It creates the description of a new variation
+
+    :param variation: The Variation object to create the description for
+    :return: The description of the variation.
+    """
+
+    return f":teacher: **Docente assente: {variation.teacher}**\n" \
+           f"\t• **Ora:** {variation.hour}^\n" \
+           f"\t• **Aula:** {variation.classroom}\n" \
+           f"\t• **Sostituto:** {variation.substitute_1}\n" + \
+           (f"\t• **Note:** {variation.notes}\n" if variation.notes else '')
+
+
+def create_removed_description(variation: Variation) -> str:
+    """
+    It creates the description of a removed variation
+
+    :param variation: The Variation object to create the description for
+    :return: The description of the variation.
+    """
+
+    return f":teacher: **Docente rientrato: {variation.teacher}**\n" \
+           f"\t• **Ora:** {variation.hour}^\n"
+
+
+def create_edited_description(variation: Variation) -> str:
+    """
+    It creates the description of an edited variation
+
+    :param variation: The Variation object to create the description for
+    :return: The description of the variation.
+    """
 
     description = f"Sono stati modificati i seguenti campi per l'assenza di **{variation.teacher}** alla **{variation.hour}^** ora:\n"
-    embed = Embed(title=title, description=description, color=color)
 
     for change in variation.edited_fields:
         match change:
             case "classroom":
-                embed.add_field(name="Aula", value=variation.classroom, inline=False)
+                description += f"\t• **Aula:** {variation.classroom}\n"
             case "substitute_1":
-                embed.add_field(name="Sostituto", value=variation.substitute_1, inline=False)
+                description += f"\t• **Sostituto:** {variation.substitute_1}\n"
             case "substitute_2":
-                embed.add_field(name="Secondo Sostituto", value=variation.substitute_2, inline=False)
+                description += f"\t• **Secondo Sostituto:** {variation.substitute_2}\n"
             case "notes":
-                embed.add_field(name="Note", value=variation.notes, inline=False)
+                description += f"\t• **Note:** {variation.notes}\n"
             case _:
                 continue
 
-    return embed
+    return description
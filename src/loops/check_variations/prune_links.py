@@ -0,0 +1,62 @@
+from datetime import date, timedelta
+
+from src.models.variation_link import VariationLink
+from src.mongo_db.variations_window import VariationsWindow
+from src.utils.metrics import metrics
+
+# Days before and after today whose links are downloaded (the same as the window, so the stored days are in memory)
+LINKS_DAYS_BEFORE = VariationsWindow.DAYS_BEFORE
+LINKS_DAYS_AFTER = VariationsWindow.DAYS_AFTER
+
+
+async def prune_links(bot, links: list[VariationLink], today: date, days_before: int = LINKS_DAYS_BEFORE,
+                      days_after: int = LINKS_DAYS_AFTER) -> list[VariationLink]:
+    """
+    Select the links to download, before downloading them: the links of the days outside the window (from
+    `days_before` days ago to `days_after` days ahead) and the ones of past days already stored are skipped.
+    Skipping a day doesn't mark its variations as removed, since only the downloaded days are classified.
+
+    :param bot: The bot instance.
+    :param links: The links of the variations page.
+    :param today: The current date.
+    :param days_before: The days before today whose links are still downloaded (if not already stored).
+    :param days_after: The days after today whose links are downloaded.
+    :return: The links to download.
+    """
+
+    start = today - timedelta(days=days_before)
+    end = today + timedelta(days=days_after)
+
+    skipped = {'no_date': 0, 'out_of_window': 0, 'stored': 0}
+
+    in_window = []
+    for link in links:
+        if link.date is None:
+            skipped['no_date'] += 1
+        elif not start <= link.date.date() <= end:
+            skipped['out_of_window'] += 1
+        else:
+            in_window.append(link)
+
+    # Past days can't change anymore once stored, today and the next days are always downloaded
+    past_days = {link.date.date() for link in in_window if link.date.date() < today}
+    stored_days = set()
+    if past_days:
+        stored_variations = await bot.variations_window.get_variations_by_date(*past_days)
+        stored_days = {var.date.date() for var in stored_variations if var.date}
+
+    selected = []
+    for link in in_window:
+        if link.date.date() in stored_days:
+            skipped['stored'] += 1
+        else:
+            selected.append(link)
+
+    for reason, count in skipped.items():
+        metrics.inc('itibot_links_skipped_total', count, {'reason': reason})
+
+    if len(selected) < len(links):
+        print(f"Skipped {len(links) - len(selected)} of {len(links)} links ("
+              + ", ".join(f"{reason}: {count}" for reason, count in skipped.items() if count) + ")")
+
+    return selected
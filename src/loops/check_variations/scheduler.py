@@ -0,0 +1,106 @@
+import random
+from datetime import datetime, timedelta
+
+from src.mongo_db.config_db import ConfigDB
+
+
+class CheckScheduler:
+    """
+    Decides when the next variations check should run.
+
+    Checks are more frequent in the hours when the school usually publishes new variations (learned from the hours in
+    which new variations have been detected), are skipped overnight and back off while nothing changes.
+    A random jitter is added to every interval.
+    """
+
+    DEFAULT_INTERVAL = 15 * 60      # seconds
+    HOT_INTERVAL = 5 * 60           # seconds, during publishing hours
+    MAX_INTERVAL = 45 * 60          # seconds
+    HOT_MAX_INTERVAL = 10 * 60      # seconds, during publishing hours
+    BACKOFF_FACTOR = 1.5            # interval multiplier for each unchanged check in a row
+    JITTER = 0.1                    # +/- 10% of the interval
+
+    QUIET_HOURS = range(1, 6)       # No checks from 1:00 to 5:59
+    HOT_HOUR_MIN_SHARE = 0.08       # Share of the detections needed to consider an hour a publishing hour
+    MIN_DETECTIONS = 20             # Detections needed before trusting the history
+
+    def __init__(self, config_db: ConfigDB):
+        self.config_db = config_db
+
+        self.publish_hours: list[int] = [0] * 24
+        self.unchanged_streak = 0
+
+        self.interval: float = self.DEFAULT_INTERVAL
+        self.next_run: datetime | None = None
+
+    async def load(self) -> None:
+        """
+        Loads the history of the hours in which new variations have been detected.
+        """
+
+        self.publish_hours = await self.config_db.get_publish_hours()
+
+    async def on_check(self, now: datetime, changed: bool) -> float:
+        """
+        Updates the history after a check and plans the next one.
+
+        :param now: The time of the check (timezone aware)
+        :param changed: Whether the check found new, edited or removed variations
+        :return: The seconds to wait before the next check
+        """
+
+        if changed:
+            self.unchanged_streak = 0
+            self.publish_hours[now.hour] += 1
+            await self.config_db.add_publish_hour(now.hour)
+        else:
+            self.unchanged_streak += 1
+
+        self.next_run = self.get_next_run(now)
+        self.interval = (self.next_run - now).total_seconds()
+
+        return self.interval
+
+    def is_hot_hour(self, hour: int) -> bool:
+        """
+        Checks if new variations are usually published in the given hour.
+
+        :param hour: The hour of the day (0-23)
+        :return: True if it's a publishing hour, False otherwise
+        """
+
+        total = sum(self.publish_hours)
+        if total < self.MIN_DETECTIONS:
+            return False
+
+        return self.publish_hours[hour] / total >= self.HOT_HOUR_MIN_SHARE
+
+    def get_next_run(self, now: datetime) -> datetime:
+        """
+        Computes the time of the next check.
+
+        :param now: The current time (timezone aware)
+        :return: The time of the next check
+        """
+
+        hot = self.is_hot_hour(now.hour)
+
+        base = self.HOT_INTERVAL if hot else self.DEFAULT_INTERVAL
+        max_interval = self.HOT_MAX_INTERVAL if hot else self.MAX_INTERVAL
+
+        interval = min(base * self.BACKOFF_FACTOR ** self.unchanged_streak, max_interval)
+        interval *= random.uniform(1 - self.JITTER, 1 + self.JITTER)
+
+        next_run = now + timedelta(seconds=interval)
+
+        # Don't skip the beginning of the next publishing hour
+        next_hour = (now + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+        if not hot and self.is_hot_hour(next_hour.hour) and next_run > next_hour:
+            next_run = next_hour + timedelta(seconds=random.uniform(0, self.JITTER * self.HOT_INTERVAL))
+
+        # Skip the night
+        if next_run.hour in self.QUIET_HOURS:
+            morning = next_run.replace(hour=self.QUIET_HOURS.stop, minute=0, second=0, microsecond=0)
+            next_run = morning + timedelta(seconds=random.uniform(0, self.JITTER * self.DEFAULT_INTERVAL))
+
+        return next_run
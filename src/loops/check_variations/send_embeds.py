@@ -1,39 +1,283 @@
-from discord import Embed
+import asyncio
 
-from src.utils.discord_utils import notify_owner, get_or_fetch_channel, get_or_fetch_role
+from discord import Embed, HTTPException, Message, Role, TextChannel
 
+from src.loops.check_variations.classify_variations import get_edited_fields
+from src.models.variation import Variation
+from src.mongo_db.outbox_db import OutboxDB
+from src.utils.discord_utils import notify_owner, pack_embeds
+from src.utils.metrics import metrics
+from src.utils.utils import create_background_task
 
-async def send_grouped_embeds(bot, grouped_embeds: dict[str, list[Embed]]) -> None:
+MAX_CONCURRENT_SENDS = 5        # Each class channel is its own route bucket, so sends can run side by side
+REACTIONS = ("\U0001f389", "\U0001f62d")
+
+send_outbox_lock = asyncio.Lock()
+_send_outbox_requested = False      # Set when a send is requested while another one is running
+
+
+async def enqueue_grouped_embeds(bot, grouped_embeds: dict[str, list[Embed]],
+                                 grouped_variations: dict[str, list[Variation]]) -> list[str]:
     """
-    It sends the embeds to the respective class channels.
+    It writes the embeds to send in the outbox (staged, they must be released once the variations have been saved).
 
     :param bot: Discord bot
     :param grouped_embeds: The embeds to send (Structured as in create_variations_embeds())
-    :return: None
+    :param grouped_variations: The variations announced by the embeds, grouped by class
+    :return: The idempotency keys of the outbox entries
     """
 
-    guild = bot.guild
+    outbox_db = OutboxDB(bot.mongo_client)
 
+    keys = []
     for class_name, embeds in grouped_embeds.items():
-        class_role = await get_or_fetch_role(guild, class_name)
-        if not class_role:
-            await notify_owner(bot, f"Role {class_name} not found")
-            continue
+        messages = [[embed.to_dict() for embed in message_embeds] for message_embeds in pack_embeds(embeds)]
+        variations = [{**var.to_dict(), 'date': var.date, 'type': var.type}
+                      for var in grouped_variations.get(class_name, [])]
+
+        keys.append(await outbox_db.enqueue(class_name, messages, variations))
+
+    return keys
+
+
+async def recover_staged_entries(bot) -> None:
+    """
+    It releases or discards the outbox entries left staged by a check that crashed before releasing them: an entry is
+    released if its variations have been saved (otherwise the next check wouldn't announce them again), and discarded
+    if they haven't (the next check will find and announce them again).
+    It must run before the first check, since the entries of a running check are staged too.
+
+    :param bot: Discord bot
+    :return: None
+    """
+
+    outbox_db = OutboxDB(bot.mongo_client)
+
+    entries = await outbox_db.get_staged_entries()
+    if not entries:
+        return
+
+    dates = {var['date'].date() for entry in entries for var in entry.get('variations', []) if var.get('date')}
+    stored = {var.key: var for var in await bot.variations_window.get_variations_by_date(*dates)} if dates else {}
+
+    def is_saved(entry: dict) -> bool:
+        # Entries staged before the variations were recorded in them can't be checked
+        if 'variations' not in entry:
+            return False
+
+        for data in entry['variations']:
+            variation = Variation.from_dict(data, data.get('date'))
+            stored_variation = stored.get(variation.key)
+
+            if data['type'] == 'removed':
+                if stored_variation is not None:
+                    return False
+            elif stored_variation is None or get_edited_fields(stored_variation, variation):
+                return False
+
+        return True
+
+    released, discarded = [], []
+    for entry in entries:
+        (released if is_saved(entry) else discarded).append(entry['key'])
+
+    if released:
+        await outbox_db.release(*released)
+    if discarded:
+        await outbox_db.discard(*discarded)
+
+    print(f"Outbox recovery: {len(released)} staged entries released, {len(discarded)} discarded")
+
+
+async def send_outbox(bot) -> None:
+    """
+    It sends the entries of the outbox to the respective class channels (concurrently) and a copy of them to the log
+    channel. If a send is already running, it's asked to run once more when done (so the entries released in the
+    meantime are sent right away) and this call returns immediately.
+
+    :param bot: Discord bot
+    :return: None
+    """
+
+    global _send_outbox_requested
+    _send_outbox_requested = True
+
+    if send_outbox_lock.locked():
+        return
+
+    async with send_outbox_lock:
+        while _send_outbox_requested:
+            _send_outbox_requested = False
+            await _send_ready_entries(bot)
+
+
+async def _send_ready_entries(bot) -> None:
+    """
+    It sends the entries of the outbox ready to be sent (see `send_outbox`).
+
+    :param bot: Discord bot
+    :return: None
+    """
+
+    outbox_db = OutboxDB(bot.mongo_client)
+
+    entries = await outbox_db.get_ready_entries()
+    if not entries:
+        return
+
+    pending = [entry for entry in entries if entry['status'] == 'pending']
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+
+    results = await asyncio.gather(*[send_class_entry(bot, outbox_db, entry, semaphore) for entry in pending])
 
-        # Find the channel for the class
-        channel_name = f'variazioni-{class_name.lower()}'
+    # Only log the entries delivered in the class channel (now, with the attempts reset, or by a previous send)
+    delivered = [{**entry, 'attempts': 0} for entry, ok in zip(pending, results) if ok] + \
+                [entry for entry in entries if entry['status'] == 'delivered']
+    if not delivered:
+        return
 
-        # Try using cache first, then fetch if not found
-        class_channel = await get_or_fetch_channel(guild, channel_name)
+    await send_log_embeds(bot, outbox_db, delivered)
 
-        if not class_channel:
-            await notify_owner(bot, f"Channel {channel_name} not found for class {class_name}")
+
+async def send_class_entry(bot, outbox_db: OutboxDB, entry: dict, semaphore: asyncio.Semaphore) -> bool:
+    """
+    It sends the messages of an outbox entry in its class channel, mentioning the class role in the first one and
+    skipping the messages already sent. Reactions are added in background.
+
+    :param bot: Discord bot
+    :param outbox_db: The outbox database
+    :param entry: The outbox entry to send
+    :param semaphore: The semaphore limiting the number of concurrent sends
+    :return: True if all the messages have been sent, False otherwise
+    """
+
+    class_name = entry['class']
+
+    # The lookups can miss temporarily (e.g. a role just created), so the entry is retried as for send errors
+    try:
+        class_role, class_channel = await get_class_destination(bot, class_name)
+    except LookupError as e:
+        retry = await outbox_db.schedule_retry(entry['_id'], entry['attempts'] + 1, str(e))
+        if not retry:
+            await notify_owner(bot, f"{e}, giving up sending variations of class {class_name}")
+
+        return False
+    messages = [[Embed.from_dict(embed) for embed in message] for message in entry['messages']]
+
+    # Send the messages in the class channel (in order)
+    try:
+        async with semaphore:
+            for i in range(entry['sent_parts'], len(messages)):
+                with metrics.timed('discord_send', {'channel': 'class'}, class_name=class_name, part=i):
+                    msg = await class_channel.send(content=class_role.mention if i == 0 else None, embeds=messages[i])
+                await outbox_db.mark_part_sent(entry['_id'], msg.id)
+
+                if i == 0:
+                    create_background_task(add_reactions(msg))
+    except HTTPException as e:
+        retry = await outbox_db.schedule_retry(entry['_id'], entry['attempts'] + 1, str(e))
+        if not retry:
+            await notify_owner(bot, f"Failed to send variations in {class_channel.name}, giving up: {e}")
+
+        return False
+
+    await outbox_db.mark_delivered(entry['_id'])
+    return True
+
+
+async def get_class_destination(bot, class_name: str) -> tuple[Role, TextChannel]:
+    """
+    It gets the role and the channel of a class.
+
+    :param bot: Discord bot
+    :param class_name: The class name (e.g. 3A)
+    :return: The role and the channel of the class
+    :raises LookupError: If the role or the channel is missing
+    """
+
+    class_role = await bot.directory.get_or_fetch_role(class_name)
+    if not class_role:
+        raise LookupError(f"Role {class_name} not found")
+
+    # Find the channel for the class
+    channel_name = f'variazioni-{class_name.lower()}'
+
+    # Try using cache first, then fetch if not found
+    class_channel = await bot.directory.get_or_fetch_channel(channel_name)
+
+    if not class_channel:
+        raise LookupError(f"Channel {channel_name} not found for class {class_name}")
+
+    return class_role, class_channel
+
+
+async def send_log_embeds(bot, outbox_db: OutboxDB, entries: list[dict]) -> None:
+    """
+    It sends a copy of the embeds of the delivered entries in the log channel (without mentions), merging all classes
+    in as few messages as possible and skipping the embeds already sent. Each embed copy has the class name as author.
+    The entries logged entirely are marked as sent, the others are retried with backoff as for the class messages.
+
+    :param bot: Discord bot
+    :param outbox_db: The outbox database
+    :param entries: The delivered entries to log
+    :return: None
+    """
+
+    # Each embed copy is paired with its entry and the number of embeds of the entry logged once it's sent
+    log_embeds = []
+    for entry in entries:
+        embeds = [Embed.from_dict(embed) for message in entry['messages'] for embed in message]
+
+        for i in range(entry.get('log_sent_embeds', 0), len(embeds)):
+            log_embeds.append((entry['_id'], i + 1, embeds[i].copy().set_author(name=f"Classe {entry['class']}")))
+
+    logged = {entry['_id']: entry.get('log_sent_embeds', 0) for entry in entries}
+    error = None
+
+    try:
+        start = 0
+        for message_embeds in pack_embeds([embed for _, _, embed in log_embeds]):
+            with metrics.timed('discord_send', {'channel': 'log'}):
+                await bot.log_channel.send(embeds=message_embeds)
+
+            progress = {}
+            for entry_id, count, _ in log_embeds[start:start + len(message_embeds)]:
+                progress[entry_id] = count
+            start += len(message_embeds)
+
+            await outbox_db.mark_log_embeds_sent(progress)
+            logged.update(progress)
+    except HTTPException as e:
+        error = e
+
+    done = [entry['_id'] for entry in entries
+            if logged[entry['_id']] >= sum(len(message) for message in entry['messages'])]
+    if done:
+        await outbox_db.mark_sent(*done)
+
+    if error is None:
+        return
+
+    for entry in entries:
+        if entry['_id'] in done:
             continue
 
-        # Send the message in the class channel
-        msg = await class_channel.send(content=class_role.mention, embeds=embeds)
-        await msg.add_reaction("\U0001f389")
-        await msg.add_reaction("\U0001f62d")
+        retry = await outbox_db.schedule_retry(entry['_id'], entry['attempts'] + 1, str(error))
+        if not retry:
+            await notify_owner(bot, f"Failed to send variations of class {entry['class']} in log channel, "
+                                    f"giving up: {error}")
+
+
+async def add_reactions(msg: Message) -> None:
+    """
+    It adds the reactions to the message (in order).
+
+    :param msg: The message to react to
+    :return: None
+    """
 
-        # Send a message in the global channel (without mentions)
-        await bot.log_channel.send(content=f"Classe: **{class_name}**", embeds=embeds)
+    try:
+        for reaction in REACTIONS:
+            await msg.add_reaction(reaction)
+    except HTTPException as e:
+        print(f"Failed to add reactions to message {msg.id}: {e}")
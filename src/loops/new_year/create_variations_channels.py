@@ -1,97 +1,190 @@
-from discord import PermissionOverwrite, utils
+import asyncio
+import re
 
-from src.utils.discord_utils import get_or_fetch_role
+from discord import PermissionOverwrite, CategoryChannel, TextChannel, HTTPException
 
+MAX_CONCURRENT_REQUESTS = 5
 
-async def create_variations_channels(bot, grouped_classes: list[list[str]]) -> None:
-    """
-    Create channels for each class in the grouped classes (and categories)
+CATEGORY_PATTERN = re.compile(r'^\d°$')
 
-    :param bot: The bot instance.
-    :param grouped_classes: The classes grouped by year (e.g. [['1A', '1B'], ['2A', '2B'], ...]).
+
+class ChannelsPlan:
+    """
+    The changes needed to make the variations channels match the classes.
     """
 
-    await delete_variations_channels(bot)
+    def __init__(self):
+        self.create_categories: list[str] = []
+        self.create_channels: list[tuple[str, str, dict]] = []                  # (channel name, category name, overwrites)
+        self.edit_channels: list[tuple[TextChannel, str, dict]] = []            # (channel, category name, overwrites)
+        self.delete_channels: list[TextChannel] = []
+        self.delete_categories: list[CategoryChannel] = []
 
-    await create_categories(bot, range(1, len(grouped_classes) + 1))
+    def is_empty(self) -> bool:
+        return not (self.create_categories or self.create_channels or self.edit_channels or
+                    self.delete_channels or self.delete_categories)
 
-    await create_channels(bot, grouped_classes)
+    def __str__(self):
+        return f"Categories to create: {self.create_categories}\n" \
+               f"Channels to create: {[name for name, _, _ in self.create_channels]}\n" \
+               f"Channels to edit: {[channel.name for channel, _, _ in self.edit_channels]}\n" \
+               f"Channels to delete: {[channel.name for channel in self.delete_channels]}\n" \
+               f"Categories to delete: {[category.name for category in self.delete_categories]}"
 
 
-async def delete_variations_channels(bot) -> None:
+async def create_variations_channels(bot, grouped_classes: list[list[str]], dry_run: bool = False) -> ChannelsPlan:
     """
-    Delete all channels that start with "variazioni-" and their categories
+    Make the variations channels (and their categories) match the classes: missing channels are created, channels with
+    wrong category or permissions are edited and channels of classes that no longer exist are deleted. Channels of
+    unchanged classes are kept (with their history).
+
+    :param bot: The bot instance.
+    :param grouped_classes: The classes grouped by year (e.g. [['1A', '1B'], ['2A', '2B'], ...]).
+    :param dry_run: If True, the changes are only computed and not applied.
+    :return: The changes needed (or applied).
     """
 
-    categories = set()
+    # Take a single snapshot of the guild channels
     channels = await bot.guild.fetch_channels()
-    for channel in channels:
-        if channel.name.startswith("variazioni-"):
-            class_name = channel.name.replace("variazioni-", "")
 
-            # If no category of categories, starts with the same number of class_name (first char), then fetch category
-            if not any([category.name[0] == class_name[0] for category in categories]):
-                categories.add(utils.get(channels, id=channel.category_id))
+    plan = await get_channels_plan(bot, grouped_classes, channels)
+    print(f"Variations channels plan{' (dry run)' if dry_run else ''}:\n{plan}")
 
-            await channel.delete(reason="Starting a new year, deleting old variations channels")
+    if not dry_run:
+        await apply_channels_plan(bot, plan, channels)
 
-    # Delete empty categories (that start with a digit)
-    for category in categories:
-        await category.delete(reason="Starting a new year, deleting empty categories")
+    return plan
 
 
-async def create_categories(bot, years: range) -> None:
+async def get_channels_plan(bot, grouped_classes: list[list[str]], channels: list) -> ChannelsPlan:
     """
-    Create categories for each year.
+    Compute the changes needed to make the variations channels match the classes.
 
     :param bot: The bot instance.
-    :param years: The range of years to create categories for (e.g. range(1, 6) for 5 years).
+    :param grouped_classes: The classes grouped by year (e.g. [['1A', '1B'], ['2A', '2B'], ...]).
+    :param channels: The current channels of the guild.
+    :return: The changes needed.
     """
 
-    for year in years:
-        category_name = f"{year}°"
+    plan = ChannelsPlan()
+
+    categories = {channel.name: channel for channel in channels if isinstance(channel, CategoryChannel)}
+    variations_channels = {channel.name: channel for channel in channels
+                           if isinstance(channel, TextChannel) and channel.name.startswith("variazioni-")}
+
+    # Desired channels: name -> (category name, overwrites)
+    desired_channels = {}
+    for class_list in grouped_classes:
+        category_name = f"{class_list[0][0]}°"
+
+        for class_name in class_list:
+            class_role = await bot.directory.get_or_fetch_role(class_name)
+            if class_role is None:
+                print(f"Error: Role not found for class {class_name}")
+                continue
+
+            desired_channels[f"variazioni-{class_name.lower()}"] = (category_name, get_channel_overwrites(bot, class_role))
+
+    desired_categories = {category_name for category_name, _ in desired_channels.values()}
+
+    plan.create_categories = sorted(desired_categories - categories.keys())
+
+    for channel_name, (category_name, overwrites) in desired_channels.items():
+        channel = variations_channels.get(channel_name)
 
-        # Check if the category already exists
-        if not any(category.name == category_name for category in bot.guild.categories):
-            await bot.guild.create_category(name=category_name, reason="Creating categories for variations channels")
+        if channel is None:
+            plan.create_channels.append((channel_name, category_name, overwrites))
+        elif not is_channel_up_to_date(channel, categories.get(category_name), overwrites):
+            plan.edit_channels.append((channel, category_name, overwrites))
 
+    plan.delete_channels = [channel for name, channel in variations_channels.items() if name not in desired_channels]
 
-async def create_channels(bot, grouped_classes: list[list[str]]) -> None:
+    # Delete year categories no longer needed, if they will be empty
+    deleted_ids = {channel.id for channel in plan.delete_channels}
+    for category_name, category in categories.items():
+        if not CATEGORY_PATTERN.match(category_name) or category_name in desired_categories:
+            continue
+
+        remaining = [channel for channel in channels if channel.category_id == category.id and channel.id not in deleted_ids]
+        if not remaining:
+            plan.delete_categories.append(category)
+
+    return plan
+
+
+async def apply_channels_plan(bot, plan: ChannelsPlan, channels: list) -> None:
     """
-    Create channels for each class in the grouped classes.
+    Apply the changes with a bounded number of concurrent requests (categories are created before the channels).
 
     :param bot: The bot instance.
-    :param grouped_classes: The classes grouped by year (e.g. [['1A', '1B'], ['2A', '2B'], ...]).
+    :param plan: The changes to apply.
+    :param channels: The current channels of the guild (the same snapshot used to compute the plan).
     """
 
-    every_perms = PermissionOverwrite(view_channel=False)
-    role_perms = PermissionOverwrite(send_messages=False, read_messages=True, read_message_history=True)
-    bot_perms = PermissionOverwrite(send_messages=True, add_reactions=True)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def run(coro):
+        async with semaphore:
+            try:
+                return await coro
+            except HTTPException as e:
+                print(f"Error applying variations channels changes: {e}")
+
+    categories = {channel.name: channel for channel in channels if isinstance(channel, CategoryChannel)}
+
+    created = await asyncio.gather(*[
+        run(bot.guild.create_category(name=name, reason="Creating categories for variations channels"))
+        for name in plan.create_categories
+    ])
+    categories.update({category.name: category for category in created if category is not None})
+
+    await asyncio.gather(
+        *[run(bot.guild.create_text_channel(name=name, category=categories.get(category_name), overwrites=overwrites,
+                                            reason="Creating variations channel for the new year"))
+          for name, category_name, overwrites in plan.create_channels],
+        *[run(channel.edit(category=categories.get(category_name), overwrites=overwrites,
+                           reason="Updating variations channel for the new year"))
+          for channel, category_name, overwrites in plan.edit_channels],
+        *[run(channel.delete(reason="Class no longer exists, deleting its variations channel"))
+          for channel in plan.delete_channels]
+    )
+
+    await asyncio.gather(*[
+        run(category.delete(reason="Deleting empty categories"))
+        for category in plan.delete_categories
+    ])
+
+
+def get_channel_overwrites(bot, class_role) -> dict:
+    """
+    Get the permissions of a variations channel (visible only to the class, only the bot can send messages).
 
-    for class_list in grouped_classes:
-        category_name = f"{class_list[0][0]}°"
-        category = next((cat for cat in bot.guild.categories if cat.name == category_name), None)
+    :param bot: The bot instance.
+    :param class_role: The role of the class.
+    :return: The overwrites of the channel.
+    """
 
-        if category is None:
-            print("Error: Category not found for class list:", class_list)
-            continue
+    return {
+        bot.guild.default_role: PermissionOverwrite(view_channel=False),
+        class_role: PermissionOverwrite(send_messages=False, read_messages=True, read_message_history=True),
+        bot.me: PermissionOverwrite(send_messages=True, add_reactions=True)
+    }
 
-        for class_name in class_list:
-            channel_name = f"variazioni-{class_name}"
-            if any(channel.name == channel_name for channel in category.text_channels):
-                continue
 
-            class_role = await get_or_fetch_role(bot.guild, class_name)
-            if class_role is None:
-                print(f"Error: Role not found for class {class_name}")
-                continue
+def is_channel_up_to_date(channel: TextChannel, category: CategoryChannel | None, overwrites: dict) -> bool:
+    """
+    Check if the channel has the given category and overwrites.
+
+    :param channel: The channel to check.
+    :param category: The desired category (None if it doesn't exist yet).
+    :param overwrites: The desired overwrites.
+    :return: True if the channel doesn't need to be edited, False otherwise.
+    """
+
+    if category is None or channel.category_id != category.id:
+        return False
+
+    current = {target.id: overwrite for target, overwrite in channel.overwrites.items()}
+    desired = {target.id: overwrite for target, overwrite in overwrites.items()}
 
-            await bot.guild.create_text_channel(
-                name=channel_name,
-                category=category,
-                overwrites={
-                    bot.guild.default_role: every_perms,
-                    class_role: role_perms,
-                    bot.me: bot_perms
-                }
-            )
+    return current == desired
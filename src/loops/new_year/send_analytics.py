@@ -2,9 +2,6 @@ import datetime
 
 from discord import Role, utils, File, Embed, Color
 
-from src.commands.analytics.plots import generate_plots
-from src.mongo_db.variations_db import VariationsDB
-
 
 async def send_analytics_selection(bot):
     now = datetime.datetime.now()
@@ -22,6 +19,9 @@ async def send_analytics_selection(bot):
 async def send_analytics_recap(bot):
     """ Send an analytics recap to the analytics channel. """
 
+    # Imported here since matplotlib is slow to import and it's needed only once a year
+    from src.commands.analytics.plots import generate_plots
+
     plots: list[File] = await generate_plots(bot)
 
     winner = await get_winner_class(bot)
@@ -35,8 +35,7 @@ async def send_analytics_recap(bot):
 
 
 async def get_winner_class(bot) -> Role | None:
-    var_db = VariationsDB(bot.mongo_client, bot.school_year)
-    leaderboard = await var_db.get_classes_leaderboard()
+    leaderboard = await bot.analytics.get_classes_leaderboard()
 
     winner = leaderboard[0]['_id'] if leaderboard else None
     if not winner:
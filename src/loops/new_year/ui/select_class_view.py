@@ -1,7 +1,11 @@
 import datetime
-import re
+import time
 
-from discord import ui, SelectOption, Interaction, utils, Embed, Color, Role, Member
+from discord import ui, SelectOption, Interaction, Embed, Color, HTTPException
+
+from src.loops.new_year.upgrade_roles import CLASS_ROLE_PATTERN
+
+DEBOUNCE_SECONDS = 3
 
 
 class SelectClassView(ui.View):
@@ -22,6 +26,8 @@ class SelectClassView(ui.View):
 
 
 class SelectClass(ui.Select):
+    _last_selections: dict[int, float] = {}     # user id -> time of the last selection
+
     def __init__(self, classes: list[str]):
         super().__init__()
         self.max_values = 1
@@ -45,14 +51,19 @@ class SelectClass(ui.Select):
             )
             return
 
-        selected_class = self.values[0]
-        user_roles = self.__get_user_roles(itr.user)
+        # Ignore double clicks
+        if self.__is_debounced(itr.user.id):
+            await itr.response.defer()          # noqa
+            return
 
-        await self.__remove_roles(itr.user, user_roles)
-        ok = await self.__add_role(itr, selected_class)
+        # Acknowledge the interaction before any other request (3 seconds timeout)
+        await itr.response.defer(ephemeral=True, thinking=True)        # noqa
 
-        if not ok:
-            await itr.response.send_message(            # noqa
+        selected_class = self.values[0]
+
+        role = itr.client.directory.get_role(selected_class)
+        if not role:
+            await itr.followup.send(
                 embed=Embed(
                     title="Errore...",
                     description=f"Il ruolo `{selected_class}` non esiste. Segnala il problema a {itr.client.owner.mention}",
@@ -62,7 +73,25 @@ class SelectClass(ui.Select):
             )
             return
 
-        await itr.response.send_message(                # noqa
+        # Replace the class roles with the selected one in a single request
+        roles = [user_role for user_role in itr.user.roles if not user_role.is_default() and not CLASS_ROLE_PATTERN.match(user_role.name)]
+        try:
+            await itr.user.edit(roles=roles + [role], reason="User selected a new class")
+        except HTTPException as e:
+            # E.g. missing permissions (role hierarchy) or rate limits, the deferred interaction must be answered
+            print(f"Failed to set role {selected_class} to {itr.user}: {e}")
+            await itr.followup.send(
+                embed=Embed(
+                    title="Errore...",
+                    description=f"Non è stato possibile assegnarti il ruolo `{selected_class}`, riprova tra poco. "
+                                f"Se il problema persiste segnalalo a {itr.client.owner.mention}",
+                    color=Color.red()
+                ),
+                ephemeral=True
+            )
+            return
+
+        await itr.followup.send(
             embed=Embed(
                 title="Ruolo aggiunto",
                 description=f"Quando ci sarà una variazione orario per questa classe, verrai taggato e vedrai il dettaglio della variazione nel canale #variazioni-{selected_class.lower()}",
@@ -71,44 +100,24 @@ class SelectClass(ui.Select):
             ephemeral=True
         )
 
-        # Clear selected values
-        await itr.message.edit()
-
-    @staticmethod
-    def __get_user_roles(user) -> list[Role]:
-        """
-        Returns a list of roles that match the pattern \\d[A-Z]+ for the given user.
-        """
-
-        return [role for role in user.roles if re.match(r'\d[A-Z]+', role.name)]
-
-    @staticmethod
-    async def __remove_roles(user: Member, roles: list[Role]) -> None:
+    @classmethod
+    def __is_debounced(cls, user_id: int) -> bool:
         """
-        Removes all the roles from the user.
+        Checks if the user has already selected a class in the last `DEBOUNCE_SECONDS` seconds, saving the current
+        selection time otherwise.
 
-        :param user: The user to remove the roles from.
-        :param roles: The roles to remove.
+        :param user_id: The id of the user.
+        :return: True if the selection must be ignored, False otherwise.
         """
 
-        for role in roles:
-            await user.remove_roles(role, reason="User selected a new class")
-
-    @staticmethod
-    async def __add_role(itr: Interaction, selected_class: str) -> bool:
-        """
-        Adds the selected class to the user and sends a confirmation message.
+        now = time.monotonic()
+        last_selection = cls._last_selections.get(user_id)
 
-        :param itr: The interaction object.
-        :param selected_class: The class to add.
+        if last_selection is not None and now - last_selection < DEBOUNCE_SECONDS:
+            return True
 
-        :return: True if the role was successfully added, False otherwise.
-        """
-
-        role = utils.get(itr.guild.roles, name=selected_class)
-
-        if not role:
-            return False
+        # Forget old selections
+        cls._last_selections = {uid: t for uid, t in cls._last_selections.items() if now - t < DEBOUNCE_SECONDS}
+        cls._last_selections[user_id] = now
 
-        await itr.user.add_roles(role, reason="User selected a new class")
-        return True
+        return False
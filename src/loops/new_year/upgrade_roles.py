@@ -1,9 +1,14 @@
+import asyncio
 import re
 
-from discord import Role, utils, Color
+from discord import Role, Color, Member, HTTPException
 
 from src.api.mim.classes import MIMClasses
-from src.utils.discord_utils import notify_owner
+from src.mongo_db.config_db import ConfigDB
+from src.utils.discord_utils import notify_owner, GuildDirectory
+
+CLASS_ROLE_PATTERN = re.compile(r'(\d)([A-Z]+)')
+MAX_CONCURRENT_UPGRADES = 5
 
 
 async def upgrade_roles(bot) -> set[str] | None:
@@ -16,7 +21,7 @@ async def upgrade_roles(bot) -> set[str] | None:
 
     # Keep only roles that match the regex pattern: \d[A-Z]+
     current_roles = await bot.guild.fetch_roles()
-    current_roles: set[Role] = set([role for role in current_roles if re.match(r'\d[A-Z]+', role.name)])
+    current_roles: set[Role] = set([role for role in current_roles if CLASS_ROLE_PATTERN.match(role.name)])
     current_roles_names = set(role.name for role in current_roles)
 
     try:
@@ -30,7 +35,7 @@ async def upgrade_roles(bot) -> set[str] | None:
 
     new_roles = new_year_classes.difference(current_roles_names)
     print(f"Creating new roles: {new_roles}")
-    await create_roles(bot.guild, new_roles)
+    await create_roles(bot.directory, new_roles)
 
     await upgrade_users_roles(bot)
 
@@ -42,10 +47,11 @@ async def upgrade_roles(bot) -> set[str] | None:
     return (current_roles_names - set(role.name for role in remove_roles)).union(new_roles)
 
 
-async def create_roles(guild, roles: set[str]):
+async def create_roles(directory: GuildDirectory, roles: set[str]):
     for role_name in roles:
         try:
-            await guild.create_role(name=role_name, mentionable=False, hoist=True, colour=Color.random(), reason="New year roles creation")
+            role = await directory.guild.create_role(name=role_name, mentionable=False, hoist=True, colour=Color.random(), reason="New year roles creation")
+            directory.add_role(role)
         except Exception as e:
             print(f"Failed to create role {role_name}: {e}")
 
@@ -59,54 +65,100 @@ async def delete_roles(roles: set[Role]):
 
 
 async def upgrade_users_roles(bot):
+    """
+    Upgrade the year of all the members with a class role (e.g. 3A -> 4A, 5A -> Diplomato), editing the roles of each
+    member with a single request. Upgraded members are saved in the database, so if the upgrade is interrupted, it
+    resumes from the members not upgraded yet.
+    """
+
+    config_db = ConfigDB(bot.mongo_client)
+    upgraded_members = await config_db.get_upgraded_members(bot.school_year)
+
+    degree_role = await get_or_create_degree_role(bot.directory)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPGRADES)
+
+    tasks = []
     async for member in bot.guild.fetch_members(limit=None):
-        # Check if member has any role with this regex pattern: \d[A-Z]+, if not, skip
-        if not any(re.match(r'\d[A-Z]+', role.name) for role in member.roles):
+        if member.id in upgraded_members:
             continue
 
-        for role in member.roles:
-            await upgrade_year(member, role)
+        roles = get_upgraded_roles(bot.directory, member.roles, degree_role)
+        if roles is None:
+            continue
+
+        tasks.append(asyncio.create_task(upgrade_member(config_db, bot.school_year, member, roles, semaphore)))
+
+    await asyncio.gather(*tasks)
 
 
-async def upgrade_year(member, role: Role):
+def get_upgraded_roles(directory: GuildDirectory, roles: list[Role], degree_role: Role) -> list[Role] | None:
     """
-    Upgrade the year of the user by removing the current role and adding the next one.
+    Get the roles of a member after the year upgrade: each class role is replaced by the one of the next year (if it
+    exists) or by the degree role for 5th year classes.
+
+    :param directory: The guild directory
+    :param roles: The current roles of the member
+    :param degree_role: The "Diplomato" role
+    :return: The new roles of the member, or None if the member has no class role
     """
 
-    match = re.match(r'(\d)([A-Z]+)', role.name)
-    if not match:
-        return
+    new_roles = []
+    has_class_role = False
+
+    for role in roles:
+        if role.is_default():
+            continue
+
+        match = CLASS_ROLE_PATTERN.match(role.name)
+        if not match:
+            new_roles.append(role)
+            continue
+
+        has_class_role = True
+        new_year = int(match.group(1)) + 1
+
+        # Handle special case for 5th year
+        if new_year > 5:
+            new_roles.append(degree_role)
+            continue
+
+        next_year_role = directory.get_role(f"{new_year}{match.group(2)}")
+        if next_year_role:
+            new_roles.append(next_year_role)
+
+    if not has_class_role:
+        return None
 
-    year = int(match.group(1))
-    class_name = match.group(2)
-    new_year = year + 1
+    # Remove duplicates (e.g. degree role already owned), keeping the order
+    return list(dict.fromkeys(new_roles))
 
-    # Remove current role
-    await member.remove_roles(role, reason="Upgrading year")
 
-    # Handle special case for 5th year
-    if new_year > 5:
-        await add_degree_role(member)
-        return
+async def upgrade_member(config_db: ConfigDB, school_year: int, member: Member, roles: list[Role], semaphore: asyncio.Semaphore):
+    """
+    Set the new roles of the member and save it as upgraded.
+    """
 
-    # Add next year role
-    next_year_role_name = f"{year + 1}{class_name}"
-    next_year_role = utils.get(member.guild.roles, name=next_year_role_name)
+    async with semaphore:
+        try:
+            await member.edit(roles=roles, reason="Upgrading year")
+        except HTTPException as e:
+            print(f"Failed to upgrade roles of {member}: {e}")
+            return
 
-    if next_year_role:
-        await member.add_roles(next_year_role, reason="Upgrading year")
+    await config_db.add_upgraded_member(school_year, member.id)
 
 
-async def add_degree_role(member):
+async def get_or_create_degree_role(directory: GuildDirectory) -> Role:
     """
-    Add the "Diplomato" role to the user.
+    Get the "Diplomato" role, creating it if it doesn't exist.
     """
 
-    degree_role = utils.get(member.guild.roles, name="Diplomato")
+    degree_role = await directory.get_or_fetch_role("Diplomato")
     if not degree_role:
-        degree_role = await member.guild.create_role(name="Diplomato", mentionable=False, hoist=True, colour=0xFFD700, reason="Role for graduated students")
+        degree_role = await directory.guild.create_role(name="Diplomato", mentionable=False, hoist=True, colour=0xFFD700, reason="Role for graduated students")
+        directory.add_role(degree_role)
 
-    await member.add_roles(degree_role, reason="Graduated from ITI Blaise Pascal")
+    return degree_role
 
 
 def group_classes(classes: set[str]) -> str:
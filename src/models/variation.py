@@ -1,22 +1,51 @@
-from datetime import datetime
+import sys
+from datetime import date as Date, datetime
 from typing import Literal
 
 
+def _intern(value: str | None) -> str | None:
+    """
+    Interns a categorical string (teacher, class, classroom), so that equal values share the same object.
+    """
+
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 class Variation:
+    """
+    A variation of the timetable.
+
+    Variations are identified by their key (date, class, teacher and hour), while the other fields and the status (type
+    and edited fields) can change. The key depends on the date, which is set after parsing, so the variations are not
+    hashable: collections of variations are indexed by `key` explicitly.
+    """
+
+    __slots__ = ('hour', 'class_name', 'classroom', 'teacher', 'substitute_1', 'substitute_2', 'notes', 'date', 'ocr',
+                 'type', 'edited_fields')
+
     def __init__(self, hour: int, class_name: str, classroom: str, teacher: str, substitute_1: str = None, substitute_2: str = None,
                  notes: str = None, date: datetime = None, ocr: bool = False,
-                 var_type: Literal['new', 'removed', 'edited'] | None = None, edited_fields: list[str] = None):
+                 var_type: Literal['new', 'removed', 'edited'] | None = None, edited_fields: tuple[str, ...] = ()):
         self.hour = hour
-        self.class_name = class_name
-        self.classroom = classroom
-        self.teacher = teacher
-        self.substitute_1 = substitute_1
-        self.substitute_2 = substitute_2
+        self.class_name = _intern(class_name)
+        self.classroom = _intern(classroom)
+        self.teacher = _intern(teacher)
+        self.substitute_1 = _intern(substitute_1)
+        self.substitute_2 = _intern(substitute_2)
         self.notes = notes
         self.date = date
         self.ocr = ocr
         self.type: Literal["new", "removed", "edited"] | None = var_type
-        self.edited_fields: list[str] = edited_fields if edited_fields is not None else []
+        self.edited_fields: tuple[str, ...] = tuple(edited_fields)
+
+    @property
+    def key(self) -> tuple[Date | None, str, str, int]:
+        """
+        The canonical key of the variation: (day, class, teacher, hour).
+        It's computed at each access, so it follows the changes of the date (see `set_date`).
+        """
+
+        return self.date.date() if self.date else None, self.class_name, self.teacher, self.hour
 
     def set_date(self, date: datetime):
         """
@@ -40,7 +69,17 @@ class Variation:
 
         :param fields: The fields that were edited.
         """
-        self.edited_fields.extend(fields)
+        self.edited_fields += fields
+
+    def copy(self) -> "Variation":
+        """
+        Returns a copy of the variation.
+
+        :return: A new Variation object with the same fields.
+        """
+
+        return Variation(self.hour, self.class_name, self.classroom, self.teacher, self.substitute_1, self.substitute_2,
+                         self.notes, self.date, self.ocr, self.type, self.edited_fields)
 
     def __str__(self):
         """
@@ -95,13 +134,6 @@ class Variation:
         :return: A Variation object.
         """
 
-        return Variation(
-            hour=data.get("hour"),
-            class_name=data.get("class"),
-            classroom=data.get("classroom"),
-            teacher=data.get("teacher"),
-            substitute_1=data.get("substitute_1"),
-            substitute_2=data.get("substitute_2"),
-            notes=data.get("notes"),
-            date=date
-        )
+        get = data.get
+        return cls(get("hour"), get("class"), get("classroom"), get("teacher"), get("substitute_1"), get("substitute_2"),
+                   get("notes"), date)
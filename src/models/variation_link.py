@@ -0,0 +1,56 @@
+import re
+from datetime import datetime
+
+from src.utils.datetime_utils import parse_italian_date
+
+
+class VariationLink:
+    """
+    A link to a variations PDF of the school site, with the date of its variations and its part number (days with
+    many variations are split in more PDFs, e.g. "... parte2.pdf").
+    """
+
+    __slots__ = ('url', 'date', 'part')
+
+    def __init__(self, url: str, date: datetime | None, part: int = 1):
+        self.url = url
+        self.date = date
+        self.part = part
+
+    @classmethod
+    def from_url(cls, url: str) -> "VariationLink":
+        """
+        Creates a VariationLink reading the date and the part number from the file name of the link.
+
+        :param url: The link to the PDF
+        :return: A new VariationLink object (with None as date if it couldn't be read)
+        """
+
+        name = url.split('/')[-1][:-4].lower()
+
+        part = re.search(r'parte\s*(\d+)', name)
+
+        # The part number is removed, so that it isn't read as the day (e.g. "parte 2 20 ottobre")
+        try:
+            date = parse_italian_date(re.search(r'\d+\s+\w+', re.sub(r'parte\s*\d+', '', name)).group(0))
+        except (AttributeError, ValueError):
+            date = None
+
+        return cls(url, date, int(part.group(1)) if part else 1)
+
+    def __eq__(self, other):
+        if not isinstance(other, VariationLink):
+            return NotImplemented
+
+        return self.url == other.url
+
+    def __hash__(self):
+        return hash(self.url)
+
+    def __repr__(self):
+        """
+        Returns a string representation of the link for debugging.
+
+        :return: A string containing the date, the part and the link.
+        """
+        return f"<VariationLink date={self.date.strftime('%d/%m/%Y') if self.date else None} part={self.part} url={self.url}>"
@@ -68,3 +68,98 @@ class ConfigDB:
             {'$set': {'current_school_year': new_school_year}},
             upsert=True
         )
+
+    async def get_upgraded_members(self, school_year: int) -> set[int]:
+        """
+        Get the members whose roles have already been upgraded at the end of the given school year
+
+        :param school_year: The school year being closed (e.g. 24 for the 2023/2024 school year)
+        :return: The ids of the upgraded members
+        """
+
+        roles_upgrade = await self.variations_collection.find_one(
+            {'_id': f'roles_upgrade_{school_year}'},
+            {'_id': 0, 'members': 1}
+        )
+
+        return set(roles_upgrade['members']) if roles_upgrade else set()
+
+    async def add_upgraded_member(self, school_year: int, member_id: int) -> None:
+        """
+        Save a member as upgraded at the end of the given school year
+
+        :param school_year: The school year being closed (e.g. 24 for the 2023/2024 school year)
+        :param member_id: The id of the upgraded member
+        :return: None
+        """
+
+        await self.variations_collection.update_one(
+            {'_id': f'roles_upgrade_{school_year}'},
+            {'$addToSet': {'members': member_id}},
+            upsert=True
+        )
+
+    async def get_publish_hours(self) -> list[int]:
+        """
+        Get how many times new variations have been detected in each hour of the day
+
+        :return: A list of 24 counters (index = hour of the day)
+        """
+
+        publish_hours = await self.variations_collection.find_one(
+            {'_id': 'publish_hours'},
+            {'_id': 0, 'hours': 1}
+        )
+
+        hours = publish_hours.get('hours', {}) if publish_hours else {}
+
+        # Saved as a list of 24 counters before being keyed by hour
+        if isinstance(hours, list):
+            return hours + [0] * (24 - len(hours))
+
+        return [hours.get(str(hour), 0) for hour in range(24)]
+
+    async def add_publish_hour(self, hour: int) -> None:
+        """
+        Increment the counter of new variations detected in the given hour of the day (atomically, so concurrent
+        increments are not lost)
+
+        :param hour: The hour of the day (0-23)
+        :return: None
+        """
+
+        await self.variations_collection.update_one(
+            {'_id': 'publish_hours'},
+            {'$inc': {f'hours.{hour}': 1}},
+            upsert=True
+        )
+
+    async def get_circuit_breaker(self, name: str) -> dict | None:
+        """
+        Get the saved state of a circuit breaker
+
+        :param name: The name of the circuit breaker
+        :return: The state (state, opened_at, cool_down), None if never saved
+        """
+
+        return await self.variations_collection.find_one(
+            {'_id': f'circuit_breaker_{name}'},
+            {'_id': 0}
+        )
+
+    async def set_circuit_breaker(self, name: str, state: str, opened_at, cool_down: float) -> None:
+        """
+        Save the state of a circuit breaker
+
+        :param name: The name of the circuit breaker
+        :param state: The state ('closed', 'open' or 'half_open')
+        :param opened_at: When the circuit has been opened (None if closed)
+        :param cool_down: The seconds to wait before probing the service again
+        :return: None
+        """
+
+        await self.variations_collection.update_one(
+            {'_id': f'circuit_breaker_{name}'},
+            {'$set': {'state': state, 'opened_at': opened_at, 'cool_down': cool_down}},
+            upsert=True
+        )
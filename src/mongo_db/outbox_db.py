@@ -0,0 +1,212 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+
+class OutboxDB:
+    """
+    Durable queue of the messages to send in the class channels.
+
+    Entries go through these statuses:
+        - staged: written before saving the variations, not sendable yet (if the check crashes before releasing it,
+          it's released or discarded at startup, depending on whether its variations have been saved)
+        - pending: sendable (the variations have been saved)
+        - delivered: sent in the class channel, the copy in the log channel is missing (or partly sent)
+        - sent: sent in the class channel and in the log channel
+        - failed: gave up after too many attempts (send errors or class role/channel missing), in the class channel or
+          in the log channel (the attempts are counted again once delivered)
+    """
+
+    RETRY_BASE_DELAY = 30          # seconds, doubled at each attempt
+    RETRY_MAX_DELAY = 30 * 60      # seconds
+    MAX_ATTEMPTS = 8
+
+    def __init__(self, mongo_client: AsyncIOMotorClient):
+        self.mongo_client = mongo_client
+        self.outbox_collection = self.mongo_client['ITI'].outbox
+
+    @staticmethod
+    def get_idempotency_key(class_name: str, messages: list[list[dict]]) -> str:
+        """
+        Get the idempotency key of an entry (hash of its content)
+
+        :param class_name: The class name (e.g. 3A)
+        :param messages: The messages to send, each one being a list of embeds (as dict)
+        :return: The idempotency key
+        """
+
+        content = json.dumps([class_name, messages], sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    async def enqueue(self, class_name: str, messages: list[list[dict]], variations: list[dict]) -> str:
+        """
+        Add an entry (staged) to the outbox, if there isn't an unsent entry with the same content
+
+        :param class_name: The class name (e.g. 3A)
+        :param messages: The messages to send, each one being a list of embeds (as dict)
+        :param variations: The variations announced by the messages (with date and type), to tell whether they have
+                           been saved if the entry is never released
+        :return: The idempotency key of the entry
+        """
+
+        key = self.get_idempotency_key(class_name, messages)
+        now = datetime.now()
+
+        await self.outbox_collection.update_one(
+            {'key': key, 'status': {'$nin': ['sent', 'failed']}},
+            {'$setOnInsert': {
+                'class': class_name,
+                'messages': messages,
+                'variations': variations,
+                'status': 'staged',
+                'attempts': 0,
+                'sent_parts': 0,
+                'log_sent_embeds': 0,
+                'message_ids': [],
+                'created_at': now,
+                'next_attempt_at': now
+            }},
+            upsert=True
+        )
+
+        return key
+
+    async def release(self, *keys: str) -> None:
+        """
+        Make the staged entries with the given keys sendable
+
+        :param keys: The idempotency keys of the entries to release
+        :return: None
+        """
+
+        await self.outbox_collection.update_many(
+            {'key': {'$in': list(keys)}, 'status': 'staged'},
+            {'$set': {'status': 'pending'}}
+        )
+
+    async def discard(self, *keys: str) -> None:
+        """
+        Delete the staged entries with the given keys (their variations have not been saved)
+
+        :param keys: The idempotency keys of the entries to discard
+        :return: None
+        """
+
+        await self.outbox_collection.delete_many({'key': {'$in': list(keys)}, 'status': 'staged'})
+
+    async def get_staged_entries(self) -> list[dict]:
+        """
+        Get the staged entries (left by a check that didn't release them)
+
+        :return: The staged entries
+        """
+
+        return await self.outbox_collection.find({'status': 'staged'}).to_list(None)
+
+    async def get_ready_entries(self) -> list[dict]:
+        """
+        Get the entries to send (pending or delivered) whose retry time has come, oldest first
+
+        :return: The entries to send
+        """
+
+        return await self.outbox_collection.find({
+            'status': {'$in': ['pending', 'delivered']},
+            'next_attempt_at': {'$lte': datetime.now()}
+        }).sort('created_at', 1).to_list(None)
+
+    async def mark_part_sent(self, entry_id: ObjectId, message_id: int) -> None:
+        """
+        Record a message of the entry as sent
+
+        :param entry_id: The id of the entry
+        :param message_id: The id of the Discord message sent
+        :return: None
+        """
+
+        await self.outbox_collection.update_one(
+            {'_id': entry_id},
+            {'$inc': {'sent_parts': 1}, '$push': {'message_ids': message_id}}
+        )
+
+    async def mark_delivered(self, entry_id: ObjectId) -> None:
+        """
+        Mark the entry as delivered in the class channel, resetting the attempts for the copy in the log channel
+
+        :param entry_id: The id of the entry
+        :return: None
+        """
+
+        await self.outbox_collection.update_one(
+            {'_id': entry_id},
+            {'$set': {'status': 'delivered', 'attempts': 0, 'next_attempt_at': datetime.now()}}
+        )
+
+    async def mark_log_embeds_sent(self, progress: dict[ObjectId, int]) -> None:
+        """
+        Record the embeds of the entries sent in the log channel so far
+
+        :param progress: The number of embeds sent in the log channel, by entry id
+        :return: None
+        """
+
+        for entry_id, count in progress.items():
+            await self.outbox_collection.update_one({'_id': entry_id}, {'$max': {'log_sent_embeds': count}})
+
+    async def mark_sent(self, *entry_ids: ObjectId) -> None:
+        """
+        Mark the entries as sent (also in the log channel)
+
+        :param entry_ids: The ids of the entries
+        :return: None
+        """
+
+        await self.outbox_collection.update_many(
+            {'_id': {'$in': list(entry_ids)}},
+            {'$set': {'status': 'sent', 'sent_at': datetime.now()}}
+        )
+
+    async def mark_failed(self, entry_id: ObjectId, error: str) -> None:
+        """
+        Mark the entry as failed (it won't be retried)
+
+        :param entry_id: The id of the entry
+        :param error: The reason of the failure
+        :return: None
+        """
+
+        await self.outbox_collection.update_one(
+            {'_id': entry_id},
+            {'$set': {'status': 'failed', 'error': error}}
+        )
+
+    async def schedule_retry(self, entry_id: ObjectId, attempts: int, error: str) -> bool:
+        """
+        Schedule a new attempt of the entry with exponential backoff, or mark it as failed if it has been attempted
+        too many times
+
+        :param entry_id: The id of the entry
+        :param attempts: The number of failed attempts so far (including the current one)
+        :param error: The reason of the failure
+        :return: True if a new attempt has been scheduled, False if the entry has been marked as failed
+        """
+
+        if attempts >= self.MAX_ATTEMPTS:
+            await self.mark_failed(entry_id, error)
+            return False
+
+        delay = min(self.RETRY_BASE_DELAY * 2 ** (attempts - 1), self.RETRY_MAX_DELAY)
+
+        await self.outbox_collection.update_one(
+            {'_id': entry_id},
+            {'$set': {
+                'attempts': attempts,
+                'next_attempt_at': datetime.now() + timedelta(seconds=delay),
+                'error': error
+            }}
+        )
+
+        return True
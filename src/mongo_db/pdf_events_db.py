@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+
+class PDFEventsDB:
+    """
+    History of the variations PDFs: when each link has been seen for the first time and each change of its content,
+    with the parser used, the parse duration and the number of variations found.
+    """
+
+    def __init__(self, mongo_client: AsyncIOMotorClient):
+        self.mongo_client = mongo_client
+        self.events_collection = self.mongo_client['ITI'].pdf_events
+
+    async def record(self, link: str, date: datetime, content_hash: str, parser: str | None, parse_duration: float,
+                     variations_count: int, last_modified: datetime | None = None) -> None:
+        """
+        Record a download of a PDF: the first time a link is seen, it's saved with its first version, then a new
+        version is added only when the content changes.
+
+        :param link: The link of the PDF
+        :param date: The date of the variations in the PDF
+        :param content_hash: The hash of the PDF content
+        :param parser: The name of the parser that parsed the PDF (None if all parsers failed)
+        :param parse_duration: The seconds spent parsing the PDF
+        :param variations_count: The number of variations found
+        :param last_modified: The Last-Modified header of the PDF, if sent by the server
+        :return: None
+        """
+
+        now = datetime.now(timezone.utc)
+        version = {
+            'hash': content_hash,
+            'seen_at': now,
+            'last_modified': last_modified,
+            'parser': parser,
+            'parse_duration': parse_duration,
+            'variations_count': variations_count
+        }
+
+        event = await self.events_collection.find_one({'_id': link}, {'_id': 0, 'last_hash': 1})
+
+        if event is None:
+            await self.events_collection.insert_one({
+                '_id': link,
+                'date': date,
+                'first_seen': now,
+                'last_seen': now,
+                'last_hash': content_hash,
+                'versions': [version]
+            })
+        elif event['last_hash'] != content_hash:
+            await self.events_collection.update_one(
+                {'_id': link},
+                {'$set': {'last_seen': now, 'last_hash': content_hash}, '$push': {'versions': version}}
+            )
+        else:
+            await self.events_collection.update_one({'_id': link}, {'$set': {'last_seen': now}})
+
+    async def get_first_seen_hours(self) -> dict:
+        """
+        Get how many PDFs have been seen for the first time in each hour of the day (Italian time)
+
+        :return: Dict containing the number of PDFs per hour ordered by hour (0-23)
+        """
+
+        scoreboard = await self.events_collection.aggregate([
+            {'$group': {'_id': {'$hour': {'date': '$first_seen', 'timezone': 'Europe/Rome'}}, 'count': {'$sum': 1}}},
+            {'$sort': {'_id': 1}}
+        ]).to_list()
+
+        # Convert scoreboard to dict
+        scoreboard = {item['_id']: item['count'] for item in scoreboard}
+
+        return {hour: scoreboard.get(hour, 0) for hour in range(24)}
+
+    async def get_detection_lags(self) -> list[float]:
+        """
+        Get the detection lag of each PDF version, i.e. the seconds between its Last-Modified date and the moment it
+        has been seen by the bot (only versions with a Last-Modified date)
+
+        :return: The detection lags in seconds
+        """
+
+        lags = await self.events_collection.aggregate([
+            {'$unwind': '$versions'},
+            {'$match': {'versions.last_modified': {'$ne': None}}},
+            {'$project': {'_id': 0, 'lag': {'$subtract': ['$versions.seen_at', '$versions.last_modified']}}}
+        ]).to_list()
+
+        return [item['lag'] / 1000 for item in lags]
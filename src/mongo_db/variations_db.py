@@ -1,4 +1,5 @@
 from datetime import datetime, date
+from typing import AsyncIterator
 
 from motor.motor_asyncio import AsyncIOMotorClient
 
@@ -6,11 +7,16 @@ from src.models.variation import Variation
 
 
 class VariationsDB:
-    def __init__(self, mongo_client: AsyncIOMotorClient, school_year: int = 26):
+    BATCH_SIZE = 1000
+
+    def __init__(self, mongo_client: AsyncIOMotorClient, school_year: int = 26, allow_disk_use: bool = False):
         self.__school_year = school_year
         self.mongo_client = mongo_client
         self.variations_collection = self.mongo_client['ITI'][f'variations{school_year}']
 
+        # Let aggregations on large years use temporary files instead of failing on the memory limit
+        self.allow_disk_use = allow_disk_use
+
     async def create_collection(self):
         """
         Create the variations collection if it doesn't exist
@@ -140,50 +146,124 @@ class VariationsDB:
         if not date:
             raise ValueError("At least one date must be provided")
 
-        variations = self.variations_collection.find(
-            {'date': {'$in': [datetime(d.year, d.month, d.day) for d in date]}},
-            {'_id': 0, 'variations': 1, 'date': 1}
-        )
+        query = {'date': {'$in': [datetime(d.year, d.month, d.day) for d in date]}}
+
+        return [Variation.from_dict(row, row['date']) async for batch in self.__iter_rows(query) for row in batch]
+
+    async def iter_variations(self, start: date = None, end: date = None,
+                              batch_size: int = BATCH_SIZE) -> AsyncIterator[Variation]:
+        """
+        Iterate over the variations in the given date range, reading them from the database in batches
+
+        :param start: The first date (inclusive), None for no lower bound
+        :param end: The last date (inclusive), None for no upper bound
+        :param batch_size: The number of variations read at a time
+        :return: An async iterator of the variations, ordered by date
+        """
+
+        async for batch in self.iter_rows(start, end, batch_size=batch_size):
+            for row in batch:
+                yield Variation.from_dict(row, row['date'])
+
+    async def iter_rows(self, start: date = None, end: date = None, fields: list[str] = None,
+                        batch_size: int = BATCH_SIZE) -> AsyncIterator[list[dict]]:
+        """
+        Iterate over the variations in the given date range as raw rows (the fields of the variation and its date),
+        in batches
+
+        :param start: The first date (inclusive), None for no lower bound
+        :param end: The last date (inclusive), None for no upper bound
+        :param fields: The fields of the variations to read (e.g. ['class', 'hour']), None for all fields
+        :param batch_size: The number of rows of each batch
+        :return: An async iterator of batches of rows, ordered by date
+        """
+
+        query = {}
+        if start is not None:
+            query.setdefault('date', {})['$gte'] = datetime(start.year, start.month, start.day)
+        if end is not None:
+            query.setdefault('date', {})['$lte'] = datetime(end.year, end.month, end.day)
 
-        if not variations:
-            return []
+        async for batch in self.__iter_rows(query, fields, batch_size):
+            yield batch
+
+    async def __iter_rows(self, query: dict, fields: list[str] = None,
+                          batch_size: int = BATCH_SIZE) -> AsyncIterator[list[dict]]:
+        """
+        Iterate over the variations of the documents matching the query, flattened into rows, in batches
+
+        :param query: The query on the documents
+        :param fields: The fields of the variations to read, None for all fields
+        :param batch_size: The number of rows of each batch
+        :return: An async iterator of batches of rows
+        """
+
+        projection = {'_id': 0, 'date': 1}
+        if fields is None:
+            projection['variations'] = 1
+        else:
+            projection.update({f'variations.{field}': 1 for field in fields})
+
+        cursor = self.variations_collection.find(query, projection).sort('date', 1).batch_size(batch_size)
+
+        batch = []
+        async for doc in cursor:
+            for var in doc.get('variations', []):
+                batch.append({**var, 'date': doc['date']})
+
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+
+        if batch:
+            yield batch
+
+    async def __aggregate(self, pipeline: list[dict], limit: int = None) -> list:
+        """
+        Run an aggregation on the collection
+
+        :param pipeline: The aggregation pipeline
+        :param limit: The maximum number of results, None for all
+        :return: The results
+        """
 
-        result = []
-        async for doc in variations:
-            result.extend([Variation.from_dict(var, doc['date']) for var in doc['variations']])
+        if limit is not None:
+            pipeline = pipeline + [{'$limit': limit}]
 
-        return result
+        return await self.variations_collection.aggregate(pipeline, allowDiskUse=self.allow_disk_use).to_list(None)
 
-    async def get_classes_leaderboard(self) -> list:
+    async def get_classes_leaderboard(self, limit: int = None) -> list:
         """
         Get the scoreboard for the classes, ordered by the number of variations for each class
 
+        :param limit: The maximum number of classes, None for all
         :return: The scoreboard
         """
 
-        scoreboard = await self.variations_collection.aggregate([
+        scoreboard = await self.__aggregate([
             {'$unwind': '$variations'},
             {'$group': {'_id': '$variations.class', 'count': {'$sum': 1}}},
             {'$match': {'_id': {'$regex': r"^[0-9][A-Z]+$"}}},
             {'$sort': {'count': -1}}
-        ]).to_list()
+        ], limit)
 
         return scoreboard
 
-    async def get_variations_per_class_age(self, class_age: int) -> list:
+    async def get_variations_per_class_age(self, class_age: int, limit: int = None) -> list:
         """
         Get the variations for the given class age. Example: class_age = 4, returns the variations for all classes in the 4th grade (4A, 4B, 4C, 4D, 4E, 4F)
 
         :param class_age: The class age to get the variations for
+        :param limit: The maximum number of classes, None for all
         :return: The variations for the given class age
         """
 
-        scoreboard = await self.variations_collection.aggregate([
+        scoreboard = await self.__aggregate([
             {'$unwind': '$variations'},
             {'$match': {'variations.class': {'$regex': f'^{class_age}[A-Z]+'}}},
             {'$group': {'_id': '$variations.class', 'variations': {'$sum': 1}}},
             {'$sort': {'variations': -1}}
-        ]).to_list()
+        ], limit)
 
         return scoreboard
 
@@ -236,20 +316,21 @@ class VariationsDB:
 
         return classes_count
 
-    async def get_professors_leaderboard(self) -> list:
+    async def get_professors_leaderboard(self, limit: int = None) -> list:
         """
         Get the scoreboard for each professor
 
+        :param limit: The maximum number of professors, None for all
         :return: The scoreboard for each professor
         """
 
         # Filter out teachers with less than 3 characters in their name (usually errors)
-        scoreboard = await self.variations_collection.aggregate([
+        scoreboard = await self.__aggregate([
             {'$unwind': '$variations'},
             {'$group': {'_id': '$variations.teacher', 'count': {'$sum': 1}}},
             {'$match': {'$expr': {'$gt': [{'$strLenCP': '$_id'}, 2]}}},
             {'$sort': {'count': -1}}
-        ]).to_list()
+        ], limit)
 
         return scoreboard
 
@@ -260,11 +341,11 @@ class VariationsDB:
         :return: Dict containing the length of variations per month ordered by month
         """
 
-        scoreboard = await self.variations_collection.aggregate([
+        scoreboard = await self.__aggregate([
             {'$unwind': '$variations'},
             {'$group': {'_id': {'$month': '$date'}, 'variations': {'$sum': 1}}},
             {'$sort': {'_id': 1}}
-        ]).to_list()
+        ])
 
         # Convert scoreboard to dict
         scoreboard = {item['_id']: item['variations'] for item in scoreboard}
@@ -287,12 +368,12 @@ class VariationsDB:
         :return: Dict containing the length of variations per day ordered by day
         """
 
-        scoreboard = await self.variations_collection.aggregate([
+        scoreboard = await self.__aggregate([
             {'$unwind': '$variations'},
             {'$match': {'date': {'$regex': f'^[0-9]+-{month}-[0-9]+$'}}},
             {'$group': {'_id': {'$dayOfMonth': '$date'}, 'variations': {'$sum': 1}}},
             {'$sort': {'_id': 1}}
-        ]).to_list()
+        ])
 
         # Convert scoreboard to dict
         scoreboard = {item['_id']: item['variations'] for item in scoreboard}
@@ -314,11 +395,11 @@ class VariationsDB:
         :return: Dict containing the length of variations per weekday ordered by weekday
         """
 
-        scoreboard = await self.variations_collection.aggregate([
+        scoreboard = await self.__aggregate([
             {'$unwind': '$variations'},
             {'$group': {'_id': {'$dayOfWeek': '$date'}, 'variations': {'$sum': 1}}},
             {'$sort': {'_id': 1}}
-        ]).to_list()
+        ])
 
         # Convert scoreboard to dict
         scoreboard = {item['_id']: item['variations'] for item in scoreboard}
@@ -332,10 +413,10 @@ class VariationsDB:
         scoreboard = {k: v for k, v in sorted(scoreboard.items(), key=lambda item: item[0])}
 
         # Get the number of documents for each weekday
-        documents_count = await self.variations_collection.aggregate([
+        documents_count = await self.__aggregate([
             {'$group': {'_id': {'$dayOfWeek': '$date'}, 'count': {'$sum': 1}}},
             {'$sort': {'_id': 1}}
-        ]).to_list()
+        ])
 
         # Convert documents_count to dict
         documents_count = {item['_id']: item['count'] for item in documents_count}
@@ -362,11 +443,11 @@ class VariationsDB:
         :return: Dict containing the length of variations per hour ordered by hour (1-6 inclusive)
         """
 
-        scoreboard = await self.variations_collection.aggregate([
+        scoreboard = await self.__aggregate([
             {'$unwind': '$variations'},
             {'$group': {'_id': '$variations.hour', 'variations': {'$sum': 1}}},
             {'$sort': {'_id': 1}}
-        ]).to_list()
+        ])
 
         # Convert the scoreboard to a dict
         scoreboard = {item['_id']: item['variations'] for item in scoreboard}
@@ -0,0 +1,124 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+import pytz
+
+from src.models.variation import Variation
+from src.mongo_db.variations_db import VariationsDB
+
+
+class VariationsWindow:
+    """
+    In-memory copy of the variations of the days around today (from DAYS_BEFORE days ago to DAYS_AFTER days ahead),
+    the ones read by every check.
+
+    Reads of dates in the window don't query the database. Writes are saved to the database and then applied to the
+    window. The window moves forward with the days, loading only the new days.
+    """
+
+    DAYS_BEFORE = 3
+    DAYS_AFTER = 7
+
+    def __init__(self, variations_db: VariationsDB):
+        self.variations_db = variations_db
+
+        self.start: date | None = None
+        self.end: date | None = None
+        self.__days: dict[date, dict[tuple, Variation]] = {}
+
+        self.__lock = asyncio.Lock()
+
+    async def load(self) -> None:
+        """
+        Loads the variations of the window from the database.
+        """
+
+        async with self.__lock:
+            await self.__move(self.__get_today())
+
+    async def get_variations_by_date(self, *dates: date) -> list[Variation]:
+        """
+        Get the variations for the given date(s), from memory for the dates in the window.
+
+        :param dates: The date(s) to get the variations for
+        :return: Copies of the variations for the given date(s)
+        """
+
+        if not dates:
+            raise ValueError("At least one date must be provided")
+
+        async with self.__lock:
+            today = self.__get_today()
+            if self.start != today - timedelta(days=self.DAYS_BEFORE):
+                await self.__move(today)
+
+            cached = [day for day in dates if day in self.__days]
+            missing = [day for day in dates if day not in self.__days]
+
+            # Copies, so that the classification doesn't change the variations in the window
+            variations = [var.copy() for day in cached for var in self.__days[day].values()]
+
+        if missing:
+            variations.extend(await self.variations_db.get_variations_by_date(*missing))
+
+        return variations
+
+    async def save_variations(self, variations: list[Variation]) -> None:
+        """
+        Save the variations to the database, then apply them to the window.
+
+        :param variations: The classified variations to save/delete
+        """
+
+        await self.variations_db.save_variations(variations)
+
+        for var in variations:
+            day = var.date.date() if var.date else None
+            if day not in self.__days:
+                continue
+
+            match var.type:
+                case 'new' | 'edited':
+                    stored = var.copy()
+                    stored.type = None
+                    stored.edited_fields = ()
+
+                    self.__days[day][var.key] = stored
+                case 'removed':
+                    self.__days[day].pop(var.key, None)
+
+    def update_school_year(self, variations_db: VariationsDB) -> None:
+        """
+        Switches to the collection of another school year, the window is loaded again on the next read.
+
+        :param variations_db: The database of the new school year
+        """
+
+        self.variations_db = variations_db
+        self.start = self.end = None
+        self.__days = {}
+
+    async def __move(self, today: date) -> None:
+        """
+        Moves the window around today, dropping the past days and loading only the days not already in memory.
+
+        :param today: The current date
+        """
+
+        start = today - timedelta(days=self.DAYS_BEFORE)
+        end = today + timedelta(days=self.DAYS_AFTER)
+
+        self.__days = {day: variations for day, variations in self.__days.items() if start <= day <= end}
+
+        load_start = start if self.end is None or self.end < start else self.end + timedelta(days=1)
+        days = {load_start + timedelta(days=i): {} for i in range((end - load_start).days + 1)}
+
+        async for var in self.variations_db.iter_variations(load_start, end):
+            days[var.date.date()].setdefault(var.key, var)
+
+        self.__days.update(days)
+        self.start, self.end = start, end
+
+    @staticmethod
+    def __get_today() -> date:
+        return datetime.now(pytz.timezone('Europe/Rome')).date()
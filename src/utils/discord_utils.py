@@ -1,7 +1,11 @@
-from discord import TextChannel, utils, Role
+import asyncio
+import time
 
-fetched_channels = []
-fetched_roles = []
+from discord import TextChannel, Role, Embed, Guild
+from discord.abc import GuildChannel
+
+MESSAGE_EMBEDS_LIMIT = 10           # Discord limit of embeds per message
+MESSAGE_EMBEDS_CHARS_LIMIT = 6000   # Discord limit of characters of all the embeds in a message
 
 
 async def delete_last_message(channel: TextChannel) -> None:
@@ -30,47 +34,184 @@ async def notify_owner(bot, message: str) -> None:
     await bot.admin_channel.send(content=f"{bot.owner.mention}\n{message}")
 
 
-async def fetch_channel(guild, channel_name: str):
-    global fetched_channels
+def pack_embeds(embeds: list[Embed]) -> list[list[Embed]]:
+    """
+    Splits the embeds in the smallest number of messages (keeping their order), respecting Discord limits on the number
+    of embeds and on the total characters of the embeds in a message.
 
-    print("Fetching channels")
-    channels = await guild.fetch_channels()
-    fetched_channels = channels
+    :param embeds: The embeds to pack
+    :return: A list of messages, each one being the list of embeds to send
+    """
 
-    return utils.get(channels, name=channel_name)
+    messages = []
+    message = []
+    message_chars = 0
 
+    for embed in embeds:
+        embed_chars = len(embed)
 
-async def fetch_role(guild, role_name: str):
-    global fetched_roles
+        if message and (len(message) >= MESSAGE_EMBEDS_LIMIT or message_chars + embed_chars > MESSAGE_EMBEDS_CHARS_LIMIT):
+            messages.append(message)
+            message = []
+            message_chars = 0
 
-    print("Fetching roles")
-    roles = await guild.fetch_roles()
-    fetched_roles = roles
+        message.append(embed)
+        message_chars += embed_chars
 
-    return utils.get(roles, name=role_name)
+    if message:
+        messages.append(message)
 
+    return messages
 
-async def get_or_fetch_channel(guild, channel_name: str):
-    channel = utils.get(guild.channels, name=channel_name)
 
-    if not channel:
-        channel = utils.get(fetched_channels, name=channel_name)
+class GuildDirectory:
+    """
+    Index of the roles and channels of a guild by name and by id.
 
-    if not channel:
-        print("Fetching channel: ", channel_name)
-        channel = await fetch_channel(guild, channel_name)
+    It's kept updated by the gateway events (see src/cogs/directory.py). When a name is missing, the whole list is
+    fetched again via REST, but at most once every `NEGATIVE_LOOKUP_INTERVAL` seconds. Concurrent lookups share the same
+    fetch, and the index is replaced only when the fetch is complete (so it's never seen empty).
+    """
+
+    NEGATIVE_LOOKUP_INTERVAL = 60
+
+    def __init__(self, guild: Guild):
+        self.guild = guild
+
+        self.__roles_by_name: dict[str, Role] = {}
+        self.__roles_by_id: dict[int, Role] = {}
+        self.__channels_by_name: dict[str, GuildChannel] = {}
+        self.__channels_by_id: dict[int, GuildChannel] = {}
+
+        self.__roles_fetched_at: float | None = None
+        self.__channels_fetched_at: float | None = None
+        self.__roles_fetch: asyncio.Task | None = None
+        self.__channels_fetch: asyncio.Task | None = None
+
+        self.load(guild)
+
+    def load(self, guild: Guild) -> None:
+        """
+        Indexes the roles and channels cached in the guild object.
+
+        :param guild: The guild (e.g. the one received from the gateway, with all the channels)
+        """
+
+        for role in guild.roles:
+            self.add_role(role)
+
+        for channel in guild.channels:
+            self.add_channel(channel)
+
+    def add_role(self, role: Role) -> None:
+        self.__roles_by_name[role.name] = role
+        self.__roles_by_id[role.id] = role
+
+    def remove_role(self, role: Role) -> None:
+        self.__roles_by_id.pop(role.id, None)
+
+        if self.__roles_by_name.get(role.name) is not None and self.__roles_by_name[role.name].id == role.id:
+            del self.__roles_by_name[role.name]
+
+    def update_role(self, before: Role, after: Role) -> None:
+        self.remove_role(before)
+        self.add_role(after)
+
+    def add_channel(self, channel: GuildChannel) -> None:
+        self.__channels_by_name[channel.name] = channel
+        self.__channels_by_id[channel.id] = channel
+
+    def remove_channel(self, channel: GuildChannel) -> None:
+        self.__channels_by_id.pop(channel.id, None)
+
+        if self.__channels_by_name.get(channel.name) is not None and self.__channels_by_name[channel.name].id == channel.id:
+            del self.__channels_by_name[channel.name]
+
+    def update_channel(self, before: GuildChannel, after: GuildChannel) -> None:
+        self.remove_channel(before)
+        self.add_channel(after)
+
+    def get_role(self, name: str) -> Role | None:
+        return self.__roles_by_name.get(name)
+
+    def get_role_by_id(self, role_id: int) -> Role | None:
+        return self.__roles_by_id.get(role_id)
+
+    def get_channel(self, name: str) -> GuildChannel | None:
+        return self.__channels_by_name.get(name)
+
+    def get_channel_by_id(self, channel_id: int) -> GuildChannel | None:
+        return self.__channels_by_id.get(channel_id)
+
+    async def get_or_fetch_role(self, name: str) -> Role | None:
+        """
+        Gets a role by name, fetching all the roles of the guild if it's missing (and they haven't been fetched
+        recently).
+
+        :param name: The name of the role
+        :return: The role or None if not found
+        """
+
+        role = self.get_role(name)
+        if role:
+            return role
+
+        # A fetch already running is joined, otherwise a new one is started (if not done recently)
+        if self.__roles_fetch is None or self.__roles_fetch.done():
+            if not self.__can_fetch(self.__roles_fetched_at):
+                return None
+
+            print("Fetching roles, missing: ", name)
+            self.__roles_fetched_at = time.monotonic()
+            self.__roles_fetch = asyncio.create_task(self.__fetch_roles())
+
+        # Shielded, so that a cancelled lookup doesn't cancel the fetch shared with the other lookups
+        await asyncio.shield(self.__roles_fetch)
+
+        return self.get_role(name)
+
+    async def get_or_fetch_channel(self, name: str) -> GuildChannel | None:
+        """
+        Gets a channel by name, fetching all the channels of the guild if it's missing (and they haven't been fetched
+        recently).
+
+        :param name: The name of the channel
+        :return: The channel or None if not found
+        """
+
+        channel = self.get_channel(name)
+        if channel:
+            return channel
+
+        # A fetch already running is joined, otherwise a new one is started (if not done recently)
+        if self.__channels_fetch is None or self.__channels_fetch.done():
+            if not self.__can_fetch(self.__channels_fetched_at):
+                return None
+
+            print("Fetching channels, missing: ", name)
+            self.__channels_fetched_at = time.monotonic()
+            self.__channels_fetch = asyncio.create_task(self.__fetch_channels())
+
+        # Shielded, so that a cancelled lookup doesn't cancel the fetch shared with the other lookups
+        await asyncio.shield(self.__channels_fetch)
+
+        return self.get_channel(name)
+
+    async def __fetch_roles(self) -> None:
+        """ Fetches all the roles of the guild, replacing the index only when they have been received. """
 
-    return channel
+        roles = await self.guild.fetch_roles()
 
+        self.__roles_by_name = {role.name: role for role in roles}
+        self.__roles_by_id = {role.id: role for role in roles}
 
-async def get_or_fetch_role(guild, role_name: str) -> Role:
-    role = utils.get(guild.roles, name=role_name)
+    async def __fetch_channels(self) -> None:
+        """ Fetches all the channels of the guild, replacing the index only when they have been received. """
 
-    if not role:
-        role = utils.get(fetched_roles, name=role_name)
+        channels = await self.guild.fetch_channels()
 
-    if not role:
-        print("Fetching role: ", role_name)
-        role = await fetch_role(guild, role_name)
+        self.__channels_by_name = {channel.name: channel for channel in channels}
+        self.__channels_by_id = {channel.id: channel for channel in channels}
 
-    return role
+    def __can_fetch(self, fetched_at: float | None) -> bool:
+        return fetched_at is None or time.monotonic() - fetched_at >= self.NEGATIVE_LOOKUP_INTERVAL
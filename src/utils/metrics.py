@@ -0,0 +1,189 @@
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+from aiohttp import web
+
+
+class MetricsSink(ABC):
+    """
+    Receives the metrics recorded by `Metrics`.
+    """
+
+    @abstractmethod
+    def inc(self, name: str, value: float, labels: dict, fields: dict) -> None:
+        """
+        Increments a counter.
+
+        :param name: The name of the counter
+        :param value: The value to add
+        :param labels: Low cardinality labels (e.g. stage, parser)
+        :param fields: Other details (e.g. the link of a PDF), only for logs
+        """
+        pass
+
+    @abstractmethod
+    def observe(self, name: str, value: float, labels: dict, fields: dict) -> None:
+        """
+        Records a value (e.g. a duration in seconds).
+
+        :param name: The name of the metric
+        :param value: The value observed
+        :param labels: Low cardinality labels (e.g. stage, parser)
+        :param fields: Other details (e.g. the link of a PDF), only for logs
+        """
+        pass
+
+
+class PrometheusRegistry(MetricsSink):
+    """
+    In-process registry of the metrics, exported in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.summaries: dict[tuple[str, tuple], list[float]] = {}      # [count, sum, max]
+
+    def inc(self, name: str, value: float, labels: dict, fields: dict) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: dict, fields: dict) -> None:
+        key = (name, tuple(sorted(labels.items())))
+
+        summary = self.summaries.setdefault(key, [0, 0.0, 0.0])
+        summary[0] += 1
+        summary[1] += value
+        summary[2] = max(summary[2], value)
+
+    def render(self) -> str:
+        """
+        Renders the metrics in the Prometheus text format.
+
+        :return: The metrics as text
+        """
+
+        def format_labels(labels: tuple) -> str:
+            if not labels:
+                return ''
+
+            escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels]
+            return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+        lines = []
+
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{format_labels(labels)} {value}"
+                         for (metric, labels), value in self.counters.items() if metric == name)
+
+        for name in sorted({name for name, _ in self.summaries}):
+            lines.append(f"# TYPE {name} summary")
+            for (metric, labels), (count, total, _) in self.summaries.items():
+                if metric != name:
+                    continue
+
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+
+            lines.append(f"# TYPE {name}_max gauge")
+            lines.extend(f"{name}_max{format_labels(labels)} {summary[2]}"
+                         for (metric, labels), summary in self.summaries.items() if metric == name)
+
+        return "\n".join(lines) + "\n"
+
+
+class JSONLogSink(MetricsSink):
+    """
+    Writes every metric as a JSON line on the `itibot.metrics` logger.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('itibot.metrics')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+        if not self.logger.handlers:
+            self.logger.addHandler(logging.StreamHandler())
+
+    def inc(self, name: str, value: float, labels: dict, fields: dict) -> None:
+        self.__log('counter', name, value, labels, fields)
+
+    def observe(self, name: str, value: float, labels: dict, fields: dict) -> None:
+        self.__log('observation', name, value, labels, fields)
+
+    def __log(self, kind: str, name: str, value: float, labels: dict, fields: dict) -> None:
+        self.logger.info(json.dumps({'ts': time.time(), 'kind': kind, 'metric': name, 'value': value, **labels, **fields},
+                                    default=str))
+
+
+class Metrics:
+    """
+    Entry point to record metrics, forwarded to all the registered sinks.
+    """
+
+    STAGE_DURATION = 'itibot_stage_duration_seconds'
+
+    def __init__(self):
+        self.sinks: list[MetricsSink] = []
+
+    def add_sink(self, sink: MetricsSink) -> None:
+        self.sinks.append(sink)
+
+    def inc(self, name: str, value: float = 1, labels: dict = None, **fields) -> None:
+        for sink in self.sinks:
+            sink.inc(name, value, labels or {}, fields)
+
+    def observe(self, name: str, value: float, labels: dict = None, **fields) -> None:
+        for sink in self.sinks:
+            sink.observe(name, value, labels or {}, fields)
+
+    @contextmanager
+    def timed(self, stage: str, labels: dict = None, **fields):
+        """
+        Measures the duration of a stage (monotonic clock), recording if it failed.
+
+        :param stage: The name of the stage (e.g. download)
+        :param labels: Low cardinality labels (e.g. the parser)
+        :param fields: Other details, only for logs
+        """
+
+        start = time.monotonic()
+        status = 'ok'
+
+        try:
+            yield
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            self.observe(self.STAGE_DURATION, time.monotonic() - start,
+                         {'stage': stage, 'status': status, **(labels or {})}, **fields)
+
+
+metrics = Metrics()
+
+
+async def start_metrics_server(registry: PrometheusRegistry, port: int, host: str = '127.0.0.1') -> web.AppRunner:
+    """
+    Serves the metrics of the registry in the Prometheus text format at http://host:port/metrics.
+
+    :param registry: The registry to serve
+    :param port: The port to listen on
+    :param host: The host to listen on (only local by default)
+    :return: The runner of the server (to stop it with `cleanup()`)
+    """
+
+    async def handle_metrics(_):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
@@ -1,4 +1,8 @@
+import io
+import mmap
+import tempfile
 from io import BytesIO
+from typing import AsyncIterable, BinaryIO
 
 import pdfplumber
 from PyPDF2 import PdfReader, PdfWriter
@@ -9,24 +13,163 @@ class ConversionException(Exception):    # maybe move
         super().__init__(message)
 
 
-def save_pdf(pdf: bytes, path: str) -> None:
+class PDFTooLargeError(Exception):
+    """ Raised when a PDF is larger than the allowed size. """
+    pass
+
+
+class PDFBuffer:
+    """
+    Read-only content of a PDF, shared without copies by the parsers (as a memoryview or as file-like readers).
+
+    Small PDFs are kept in memory, the larger ones are spooled to a temporary file which is memory-mapped, so they
+    don't take up memory of the process. Use it as a context manager (or call `close`) to free it.
     """
-    Saves PDF bytes to a specified file path.
 
-    :param pdf: PDF bytes to be saved
+    SPOOL_SIZE = 4 * 1024 * 1024    # bytes kept in memory before moving to a temporary file
+
+    def __init__(self, content: bytes | BytesIO | BinaryIO):
+        """
+        :param content: The PDF as bytes, as a BytesIO (its buffer is used as is) or as a (non-empty) file
+        """
+
+        self.__file = None
+        self.__mmap = None
+
+        if isinstance(content, BytesIO):
+            self.__file = content
+            view = content.getbuffer()
+        elif isinstance(content, (bytes, bytearray, memoryview)):
+            view = memoryview(content)
+        else:
+            self.__file = content
+            self.__mmap = mmap.mmap(content.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(self.__mmap)
+
+        self.view = view.toreadonly()
+
+    @classmethod
+    async def from_stream(cls, chunks: AsyncIterable[bytes], max_size: int) -> 'PDFBuffer':
+        """
+        Create the buffer from a stream (e.g. a download), spooling it to a temporary file when it gets large.
+
+        :param chunks: The chunks of the PDF
+        :param max_size: The maximum size of the PDF in bytes, PDFTooLargeError is raised beyond it
+        :return: The buffer
+        """
+
+        file: BinaryIO = BytesIO()
+        size = 0
+
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise PDFTooLargeError(f"PDF larger than {max_size} bytes")
+
+                if isinstance(file, BytesIO) and size > cls.SPOOL_SIZE:
+                    spooled = tempfile.TemporaryFile()
+                    spooled.write(file.getbuffer())
+                    file = spooled
+
+                file.write(chunk)
+
+            file.flush()
+            return cls(file)
+        except BaseException:
+            file.close()
+            raise
+
+    def open(self) -> BinaryIO:
+        """
+        Open a reader of the content (each reader has its own position).
+
+        :return: A read-only binary file-like object
+        """
+
+        return io.BufferedReader(_BufferReader(self.view))
+
+    def close(self) -> None:
+        self.view.release()
+
+        if self.__mmap is not None:
+            self.__mmap.close()
+        if self.__file is not None:
+            self.__file.close()
+
+    def __len__(self) -> int:
+        return self.view.nbytes
+
+    def __enter__(self) -> 'PDFBuffer':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+class _BufferReader(io.RawIOBase):
+    """ A seekable reader of a buffer, reading directly from it. """
+
+    def __init__(self, view: memoryview):
+        super().__init__()
+        self.__view = view
+        self.__position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.__view[self.__position:self.__position + len(buffer)]
+        size = data.nbytes
+
+        buffer[:size] = data
+        data.release()
+
+        self.__position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        match whence:
+            case io.SEEK_SET:
+                position = offset
+            case io.SEEK_CUR:
+                position = self.__position + offset
+            case io.SEEK_END:
+                position = self.__view.nbytes + offset
+            case _:
+                raise ValueError(f"Invalid whence: {whence}")
+
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+
+        self.__position = position
+        return position
+
+    def tell(self) -> int:
+        return self.__position
+
+
+def save_pdf(pdf: PDFBuffer, path: str) -> None:
+    """
+    Saves a PDF to a specified file path.
+
+    :param pdf: PDF to be saved
     :param path: Path where the PDF will be saved
     """
     with open(path, 'wb') as f:
-        f.write(pdf)
+        f.write(pdf.view)
 
 
-def rotate_pdf(pdf: bytes, rotation_degrees: int) -> bytes:
+def rotate_pdf(pdf: PDFBuffer, rotation_degrees: int) -> PDFBuffer:
     """
     Rotates the pages of a PDF by a specified number of degrees.
 
-    :param pdf: PDF bytes to be rotated
+    :param pdf: PDF to be rotated
     :param rotation_degrees: The degrees to rotate the PDF pages. Must be a multiple of 90.
-    :return: Rotated PDF bytes
+    :return: Rotated PDF (the same PDF if not rotated, otherwise a new one to be closed by the caller)
     """
     if rotation_degrees % 90 != 0:
         raise ValueError("rotation_degrees must be a multiple of 90")
@@ -34,7 +177,9 @@ def rotate_pdf(pdf: bytes, rotation_degrees: int) -> bytes:
     if rotation_degrees % 360 == 0:
         return pdf
 
-    with BytesIO(pdf) as input_stream, BytesIO() as output_stream:
+    output_stream = BytesIO()
+
+    with pdf.open() as input_stream:
         reader = PdfReader(input_stream)
         writer = PdfWriter()
 
@@ -43,14 +188,15 @@ def rotate_pdf(pdf: bytes, rotation_degrees: int) -> bytes:
             writer.add_page(page)
 
         writer.write(output_stream)
-        return output_stream.getvalue()
+
+    return PDFBuffer(output_stream)
 
 
-def get_rows_from_pdf_table(pdf: bytes, table_settings: dict = None) -> list[list[str]]:
+def get_rows_from_pdf_table(pdf: PDFBuffer, table_settings: dict = None) -> list[list[str]]:
     """
     Extracts rows from a PDF table (text-based extraction).
 
-    :param pdf: PDF bytes
+    :param pdf: PDF to read
     :param table_settings: Settings for the table extraction
     :return: A list of strings, each representing a row in the PDF
     """
@@ -59,7 +205,7 @@ def get_rows_from_pdf_table(pdf: bytes, table_settings: dict = None) -> list[lis
         table_settings = {}
 
     lines = []
-    with pdfplumber.open(BytesIO(pdf)) as pdf:
+    with pdfplumber.open(pdf.open()) as pdf:
         for page in pdf.pages:
             table = page.extract_table(table_settings=table_settings)
             lines.extend(table)
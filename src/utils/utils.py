@@ -8,3 +8,23 @@ def to_thread(func: typing.Callable) -> typing.Callable:
     async def wrapper(*args, **kwargs):
         return await asyncio.to_thread(func, *args, **kwargs)
     return wrapper
+
+
+# Keep a reference to background tasks, otherwise they could be garbage collected before completion
+_background_tasks: set[asyncio.Task] = set()
+
+
+def create_background_task(coro: typing.Coroutine) -> asyncio.Task:
+    """
+    It schedules the coroutine without waiting for it, keeping a reference to the task until it's done.
+
+    :param coro: The coroutine to run
+    :return: The task running the coroutine
+    """
+
+    task = asyncio.create_task(coro)
+
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+    return task